@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import FileResponse
+from django.urls import URLPattern, URLResolver
+from rest_framework.permissions import SAFE_METHODS
+
+from .middleware import track_queries
+
+# Потоки для синхронного кода с обращениями к БД: их число
+# ограничивает одновременные запросы к БД одного процесса
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='db')
+
+# Горячие эндпоинты чтения: их запросы на чтение выполняются в пуле
+# db_executor. Остальные - как синхронные представления Django
+# под ASGI, в одном общем потоке
+POOLED_VIEWS = {
+    'recipe-list',
+    'recipe-detail',
+    'tag-list',
+    'tag-detail',
+    'ingredient-list',
+    'recipe-download-shopping-cart',
+}
+
+# Потоковый ответ передается частями не меньше этого размера (кроме
+# первой: она отправляется сразу); готовых частей в очереди к циклу
+# событий - не больше STREAM_QUEUE_SIZE
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_QUEUE_SIZE = 4
+
+
+def database_sync_to_async(func):
+    '''
+    Выполняет синхронную функцию в пуле db_executor.
+    Соединения с БД закрываются, как в конце обычного запроса
+    '''
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=db_executor)
+
+
+async def iterate_in_pool(content):
+    '''
+    Части потокового ответа, сформированные в одном потоке пула
+    db_executor: итератор queryset привязан к соединению потока.
+    Поток ждет, пока цикл событий заберет части из очереди,
+    и останавливается, если перебор прерван (клиент отключился)
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        buffer = bytearray()
+        sent = False
+        try:
+            for chunk in content:
+                buffer += chunk
+                if not sent or len(buffer) >= STREAM_CHUNK_SIZE:
+                    put(bytes(buffer))
+                    buffer.clear()
+                    sent = True
+                    if stopped.is_set():
+                        return
+            if buffer:
+                put(bytes(buffer))
+        except Exception as error:
+            put(error)
+        finally:
+            put(done)
+
+    producer = asyncio.ensure_future(database_sync_to_async(produce)())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        # Освобождаем очередь, чтобы поток дошел до проверки stopped
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    '''
+    ASGIHandler, который формирует потоковые ответы в пуле db_executor.
+    Django 3.2 перебирает их прямо в цикле событий, где обращаться
+    к БД нельзя; здесь в цикл событий приходят готовые части,
+    и клиент получает первые байты, пока остальные читаются из БД
+    '''
+    async def send_response(self, response, send):
+        if not response.streaming or isinstance(response, FileResponse):
+            return await super().send_response(response, send)
+        content = response.streaming_content
+        response.streaming_content = ()
+
+        async def send_with_content(message):
+            # Части отправляются перед завершающим сообщением ответа
+            if (
+                message['type'] == 'http.response.body'
+                and not message.get('more_body')
+            ):
+                async for chunk in iterate_in_pool(content):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send(message)
+
+        await super().send_response(response, send_with_content)
+
+
+def as_async_view(view, pooled):
+    '''
+    Асинхронная версия синхронного представления DRF.
+    Под ASGI Django 3.2 выполняет все синхронные представления
+    процесса в одном потоке, а асинхронной версии ORM у него нет.
+    Запрос на чтение к pooled-представлению целиком (проверка токена,
+    ORM, сериализация и отрисовка) уходит в пул потоков, а цикл событий
+    в это время обслуживает остальные соединения. Остальные запросы
+    выполняются в общем потоке, как без обертки, но с замером SQL
+    и отрисовки для Server-Timing
+    '''
+    def respond(request, *args, **kwargs):
+        with track_queries(getattr(request, 'query_timer', None)):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                # Время отрисовки для Server-Timing: под ASGI ответ
+                # отрисовывается здесь, а не после middleware
+                request.render_started = time.perf_counter()
+                response.render()
+                request.render_finished = time.perf_counter()
+        return response
+
+    pooled_respond = database_sync_to_async(respond)
+    shared_respond = sync_to_async(respond, thread_sensitive=True)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if pooled and request.method in SAFE_METHODS:
+            return await pooled_respond(request, *args, **kwargs)
+        return await shared_respond(request, *args, **kwargs)
+
+    return async_view
+
+
+def async_patterns(patterns):
+    '''
+    URL-шаблоны с асинхронными версиями всех представлений:
+    в пуле потоков - только POOLED_VIEWS
+    '''
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern,
+                async_patterns(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace
+            )
+        else:
+            pattern = URLPattern(
+                pattern.pattern,
+                as_async_view(
+                    pattern.callback, pattern.name in POOLED_VIEWS),
+                pattern.default_args,
+                pattern.name
+            )
+        result.append(pattern)
+    return result
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+from .lru import LocalLRU
+
+User = get_user_model()
+
+TOKEN_KEY = 'token:{}'
+# Поля, которые хранятся в кэше: у пользователя - все, кроме пароля
+USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.name != 'password'
+)
+TOKEN_FIELDS = tuple(field.attname for field in Token._meta.concrete_fields)
+
+local_tokens = LocalLRU(settings.TOKEN_CACHE_SIZE)
+
+
+def forget_tokens(*keys):
+    '''
+    Удаляет токены из кэшей: общего и памяти текущего процесса
+    '''
+    cache_keys = [TOKEN_KEY.format(key) for key in keys]
+    cache.delete_many(cache_keys)
+    local_tokens.delete_many(cache_keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    TokenAuthentication без запроса к БД на каждый запрос чтения:
+    поля пользователя и токена кэшируются в памяти процесса
+    и в общем кэше, объекты собираются из них заново на каждый запрос.
+    Записи удаляются при удалении токена (logout) и изменении
+    пользователя, в памяти других процессов старая запись живет
+    не дольше TOKEN_CACHE_LOCAL_TIMEOUT. Запросы на запись получают
+    пользователя из БД: его сохраняют (смена пароля, профиль)
+    '''
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.use_cache:
+            return self.load_token(key)
+        cache_key = TOKEN_KEY.format(key)
+        now = time.monotonic()
+        expires, payload = local_tokens.get_many(
+            (cache_key,)).get(cache_key, (0, None))
+        if expires < now:
+            payload = cache.get(cache_key)
+            if payload is None:
+                user, token = self.load_token(key)
+                # Хэш пароля в кэш не попадает
+                payload = (
+                    tuple(getattr(user, name) for name in USER_FIELDS),
+                    tuple(getattr(token, name) for name in TOKEN_FIELDS)
+                )
+                cache.set(cache_key, payload, settings.TOKEN_CACHE_TIMEOUT)
+            local_tokens.set_many({
+                cache_key: (now + settings.TOKEN_CACHE_LOCAL_TIMEOUT, payload)
+            })
+        user_values, token_values = payload
+        return (
+            User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, user_values),
+            self.get_model().from_db(
+                DEFAULT_DB_ALIAS, TOKEN_FIELDS, token_values)
+        )
+
+    def load_token(self, key):
+        model = self.get_model()
+        try:
+            token = model.objects.select_related('user').get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
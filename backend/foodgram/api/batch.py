@@ -0,0 +1,113 @@
+from django.db import connection, transaction
+from rest_framework.response import Response
+
+from recipes.signals import bulk_post_create, bulk_post_delete
+from .serializers import BatchSerializer
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+NOT_FOUND = 'not_found'
+NOT_ALLOWED = 'not_allowed'
+
+
+def link_columns(model, field):
+    return (
+        model._meta.db_table,
+        model._meta.get_field('user').column,
+        model._meta.get_field(field).column
+    )
+
+
+def insert_links(model, user, field, pks):
+    '''
+    Создает связи пользователя с объектами pks одним запросом.
+    Возвращает id объектов, связи с которыми действительно созданы:
+    связь, созданная параллельным запросом, пропускается
+    '''
+    if not pks:
+        return set()
+    if connection.vendor != 'postgresql':
+        # В SQLite пишущие транзакции не пересекаются:
+        # связей, которых не было при чтении, и сейчас нет
+        model.objects.bulk_create(
+            [model(user=user, **{field: pk}) for pk in pks],
+            ignore_conflicts=True)
+        return set(pks)
+    table, user_column, column = link_columns(model, field)
+    values = ', '.join(['(%s, %s)'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {column}) '
+            f'VALUES {values} ON CONFLICT DO NOTHING RETURNING {column}',
+            [value for pk in pks for value in (user.pk, pk)]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def delete_links(model, user, field, pks, existing):
+    '''
+    Удаляет связи пользователя с объектами pks одним запросом, без
+    сигналов на каждую запись. Возвращает id объектов, связи с которыми
+    действительно удалены (existing - прочитанные до удаления)
+    '''
+    if not existing:
+        return set()
+    table, user_column, column = link_columns(model, field)
+    placeholders = ', '.join(['%s'] * len(pks))
+    sql = (
+        f'DELETE FROM {table} '
+        f'WHERE {user_column} = %s AND {column} IN ({placeholders})'
+    )
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute(sql, [user.pk, *pks])
+            return existing
+        cursor.execute(f'{sql} RETURNING {column}', [user.pk, *pks])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def batch_response(request, model, field, targets, excluded=()):
+    '''
+    Пакетное добавление (POST) или удаление (DELETE) связей
+    пользователя с объектами targets по списку id.
+    Все изменения - в одной транзакции, ответ - статус для каждого id.
+    Счетчики, лента и итоги корзины меняются только для связей,
+    которые этот запрос действительно создал или удалил
+    '''
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    user = request.user
+    links = model.objects.filter(user=user, **{f'{field}__in': ids})
+    with transaction.atomic():
+        existing = set(links.values_list(field, flat=True))
+        if request.method == 'DELETE':
+            deleted = delete_links(model, user, field, ids, existing)
+            bulk_post_delete(
+                model, [model(user=user, **{field: pk}) for pk in deleted])
+            statuses = {
+                pk: DELETED if pk in deleted else NOT_FOUND for pk in ids
+            }
+        else:
+            found = set(targets.filter(pk__in=ids).exclude(
+                pk__in=excluded).values_list('pk', flat=True))
+            created = insert_links(model, user, field, [
+                pk for pk in ids if pk in found and pk not in existing
+            ])
+            bulk_post_create(
+                model, [model(user=user, **{field: pk}) for pk in created])
+            statuses = {}
+            for pk in ids:
+                if pk in excluded:
+                    statuses[pk] = NOT_ALLOWED
+                elif pk not in found:
+                    statuses[pk] = NOT_FOUND
+                elif pk in created:
+                    statuses[pk] = CREATED
+                else:
+                    statuses[pk] = EXISTS
+    return Response([
+        {'id': pk, 'status': batch_status}
+        for pk, batch_status in statuses.items()
+    ])
@@ -0,0 +1,44 @@
+import hashlib
+from datetime import datetime, timezone
+
+from django.views.decorators.http import condition
+
+from recipes.versions import get_versions, user_scope
+
+
+def request_scopes(request, scopes):
+    '''
+    Области данных ответа: для авторизованного пользователя
+    добавляется его личное состояние (избранное, корзина, подписки)
+    '''
+    if 'user' in scopes:
+        scopes = [scope for scope in scopes if scope != 'user']
+        if request.user.is_authenticated:
+            scopes.append(user_scope(request.user.pk))
+    return scopes
+
+
+def conditional(*scopes, unless=None):
+    '''
+    ETag и Last-Modified по версиям данных без рендеринга ответа:
+    при совпадении валидаторов Django вернет 304.
+    Для запросов, на которых unless(request) истинно, валидаторов нет:
+    их ответ зависит от данных, у которых нет версии
+    '''
+    def get_etag(request, *args, **kwargs):
+        if unless and unless(request):
+            return None
+        versions = get_versions(*request_scopes(request, list(scopes)))
+        key = f'{request.get_full_path()}:{versions}'
+        if request.user.is_authenticated:
+            key = f'{request.user.pk}:{key}'
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get_last_modified(request, *args, **kwargs):
+        if unless and unless(request):
+            return None
+        versions = get_versions(*request_scopes(request, list(scopes)))
+        return datetime.fromtimestamp(max(versions) / 1e9, tz=timezone.utc)
+
+    return condition(
+        etag_func=get_etag, last_modified_func=get_last_modified)
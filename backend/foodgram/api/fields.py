@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+from recipes.images import IMAGE_VARIANTS
+
+
+class RecipeImageField(Base64ImageField):
+    '''
+    Base64ImageField с ограничением размера: слишком большой файл
+    отклоняется по длине строки, до декодирования
+    '''
+    default_error_messages = {
+        'too_large': 'Размер картинки не должен превышать {max_size} КБ',
+    }
+
+    def to_internal_value(self, base64_data):
+        if isinstance(base64_data, str):
+            encoded = base64_data.partition(';base64,')[2] or base64_data
+            if len(encoded) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+                self.fail(
+                    'too_large',
+                    max_size=settings.RECIPE_IMAGE_MAX_SIZE // 1024
+                )
+        return super().to_internal_value(base64_data)
+
+
+class ImageVariantsField(serializers.Field):
+    '''
+    Ссылки на уменьшенные копии картинки рецепта.
+    Пока копии не готовы, вместо них отдается исходная картинка
+    '''
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return {}
+        request = self.context.get('request')
+        urls = {}
+        for name in IMAGE_VARIANTS:
+            if name in recipe.image_variants:
+                url = default_storage.url(recipe.image_variants[name])
+            else:
+                url = recipe.image.url
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
@@ -4,11 +4,15 @@ from django_filters.rest_framework import (
     ModelMultipleChoiceFilter,
     CharFilter
 )
+from django.db.models.functions import Lower
+from rest_framework.filters import OrderingFilter
 from recipes.models import (
     Tag,
     Recipe,
     Ingredient
 )
+from recipes.search import search_recipes
+from recipes.tag_mask import filter_by_tags
 
 
 class RecipesFilter(FilterSet):
@@ -22,10 +26,16 @@ class RecipesFilter(FilterSet):
         method='filter_is_in_shopping_cart'
     )
     tags = ModelMultipleChoiceFilter(
-        field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags'
     )
+    all_tags = ModelMultipleChoiceFilter(
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+        method='filter_tags'
+    )
+    search = CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -45,6 +55,32 @@ class RecipesFilter(FilterSet):
             return filtered_queryset
         return queryset
 
+    def filter_tags(self, queryset, name, value):
+        '''
+        ?tags - рецепты хотя бы с одним из тегов,
+        ?all_tags - со всеми тегами сразу
+        '''
+        if not value:
+            return queryset
+        return filter_by_tags(queryset, value, match_all=name == 'all_tags')
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    '''
+    Сортировка рецептов: при поиске без явного ?ordering
+    сохраняется порядок по релевантности
+    '''
+    def get_ordering(self, request, queryset, view):
+        if (
+            self.ordering_param not in request.query_params
+            and request.query_params.get('search')
+        ):
+            return None
+        return super().get_ordering(request, queryset, view)
+
 
 class IngredientSearchFilter(FilterSet):
     '''
@@ -57,9 +93,13 @@ class IngredientSearchFilter(FilterSet):
         fields = ('name',)
 
     def search_ingredient(self, queryset, name, value):
+        # lower(name) LIKE 'префикс%' - по индексу ingredient_name_lower_idx
         if value:
             low_case_value = value.lower()
-            filtered_queryset = queryset.filter(
-                name__startswith=low_case_value
+            filtered_queryset = queryset.alias(
+                name_lower=Lower('name')
+            ).filter(
+                name_lower__startswith=low_case_value
             )
             return filtered_queryset
+        return queryset
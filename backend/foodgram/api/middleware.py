@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from .replicas import RequestState, request_state
+
+logger = logging.getLogger('api.timing')
+slow_query_logger = logging.getLogger('api.timing.slow_queries')
+
+
+class QueryTimer:
+    '''
+    Обертка выполнения SQL (connection.execute_wrapper):
+    считает запросы и их суммарное время, медленные пишет в лог.
+    Здесь же копится время сериализации ответа (track_serialization)
+    '''
+    def __init__(self, request, slow_threshold, slow_sample_rate):
+        self.request = request
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.count = 0
+        self.duration = 0.0
+        self.serialize = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.duration += duration
+            if (duration >= self.slow_threshold
+                    and random.random() < self.slow_sample_rate):
+                # Параметры не пишем: в них бывают токены и пароли
+                slow_query_logger.warning(
+                    'slow query path=%s duration_ms=%.1f sql=%s',
+                    self.request.path, duration, sql[:1000],
+                    extra={
+                        'path': self.request.path,
+                        'duration_ms': round(duration, 1),
+                        'database': context['connection'].alias,
+                    }
+                )
+
+
+@contextmanager
+def track_queries(timer):
+    '''
+    Подключает timer ко всем соединениям с БД текущего потока
+    '''
+    with ExitStack() as stack:
+        if timer is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+        yield
+
+
+@contextmanager
+def track_serialization(request):
+    '''
+    Время построения данных ответа (сериализаторы, представления
+    рецептов) без SQL-запросов внутри - в метрику serialize
+    '''
+    timer = getattr(request, 'query_timer', None)
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    queries = timer.duration
+    try:
+        yield
+    finally:
+        timer.serialize += (
+            (time.perf_counter() - started) * 1000
+            - (timer.duration - queries)
+        )
+
+
+def serializer_data(request, serializer):
+    '''
+    serializer.data с замером времени сериализации
+    '''
+    with track_serialization(request):
+        return serializer.data
+
+
+class ServerTimingMiddleware:
+    '''
+    Замеряет время ответа, число и время SQL-запросов, время
+    сериализации (где она обернута в track_serialization) и время
+    отрисовки ответа DRF. Остальное время - app. Итоги - в заголовке
+    Server-Timing и в логе api.timing (с долей REQUEST_LOG_SAMPLE_RATE).
+    Должен стоять первым в MIDDLEWARE
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.log_sample_rate = settings.REQUEST_LOG_SAMPLE_RATE
+        self.slow_threshold = settings.SLOW_QUERY_THRESHOLD
+        self.slow_sample_rate = settings.SLOW_QUERY_SAMPLE_RATE
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI middleware сам становится корутиной,
+            # как MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request.query_timer = QueryTimer(
+            request, self.slow_threshold, self.slow_sample_rate)
+        started = time.perf_counter()
+        with track_queries(request.query_timer):
+            response = self.get_response(request)
+        return self.finish(request, response, started)
+
+    async def __acall__(self, request):
+        # Запросы к БД выполняются в потоках пула (api.async_views),
+        # timer подключается там
+        request.query_timer = QueryTimer(
+            request, self.slow_threshold, self.slow_sample_rate)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.finish(request, response, started)
+
+    def finish(self, request, response, started):
+        timer = request.query_timer
+        total = (time.perf_counter() - started) * 1000
+        render = 0.0
+        if hasattr(request, 'render_finished'):
+            render = (request.render_finished - request.render_started) * 1000
+        serialize = timer.serialize
+        app = max(total - timer.duration - serialize - render, 0.0)
+        response['Server-Timing'] = (
+            f'db;dur={timer.duration:.1f};desc="{timer.count} queries", '
+            f'app;dur={app:.1f}, serialize;dur={serialize:.1f}, '
+            f'render;dur={render:.1f}, total;dur={total:.1f}'
+        )
+        if random.random() < self.log_sample_rate:
+            logger.info(
+                'request method=%s path=%s status=%s total_ms=%.1f '
+                'db_ms=%.1f queries=%s app_ms=%.1f serialize_ms=%.1f '
+                'render_ms=%.1f',
+                request.method, request.path, response.status_code, total,
+                timer.duration, timer.count, app, serialize, render,
+                extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'total_ms': round(total, 1),
+                    'db_ms': round(timer.duration, 1),
+                    'queries': timer.count,
+                    'app_ms': round(app, 1),
+                    'serialize_ms': round(serialize, 1),
+                    'render_ms': round(render, 1),
+                }
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается прямо перед render() ответа DRF. Под ASGI ответ
+        # уже отрисован и замерен в api.async_views
+        if response.is_rendered:
+            return response
+
+        def finish_render(rendered):
+            request.render_finished = time.perf_counter()
+
+        request.render_started = time.perf_counter()
+        response.add_post_render_callback(finish_render)
+        return response
+
+
+class ReplicaMiddleware:
+    '''
+    Передает роутеру БД (api.replicas.ReplicaRouter) метод запроса
+    и клиента, для которого запоминаются недавние записи
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = request_state.set(RequestState(request))
+        try:
+            return self.get_response(request)
+        finally:
+            request_state.reset(token)
+
+    async def __acall__(self, request):
+        # Потоки sync_to_async получают копию контекста вместе с состоянием
+        token = request_state.set(RequestState(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            request_state.reset(token)
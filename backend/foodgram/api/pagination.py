@@ -1,5 +1,169 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Position = namedtuple('Position', ('created', 'pk'))
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(BasePagination):
+    '''
+    Keyset-пагинация ленты рецептов по (-created, id):
+    страница выбирается условием по ключу последнего рецепта,
+    без OFFSET и без подсчета общего количества.
+    Включается параметром ?cursor (пустым для первой страницы).
+    Другой порядок (?ordering, релевантность при поиске) курсор
+    не сохранил бы: такой запрос отклоняется
+    '''
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+    ordering = ('-created', 'id')
+    invalid_cursor_message = 'Неверный курсор'
+    invalid_ordering_message = (
+        'Курсор работает только с сортировкой по дате: '
+        'без ordering и search'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.check_ordering(queryset)
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        created, pk, reverse = self.decode_cursor(request)
+        results = self.fetch(queryset, created, pk, reverse)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = created is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = created is not None
+        self.page = results
+        return results
+
+    def check_ordering(self, queryset):
+        '''
+        Порядок queryset должен быть началом ordering (или порядком
+        модели по умолчанию)
+        '''
+        ordering = tuple(queryset.query.order_by)
+        if ordering != self.ordering[:len(ordering)]:
+            raise ValidationError(
+                {self.cursor_query_param: [self.invalid_ordering_message]})
+
+    def fetch(self, queryset, created, pk, reverse, id_field='id'):
+        '''
+        Рецепты после позиции курсора: лишний рецепт в конце
+        показывает, есть ли следующая страница
+        '''
+        if reverse:
+            queryset = queryset.order_by('created', f'-{id_field}')
+        else:
+            queryset = queryset.order_by('-created', id_field)
+        if created is not None:
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created__gt=created)
+                    | Q(created=created, **{f'{id_field}__lt': pk}))
+            else:
+                queryset = queryset.filter(
+                    Q(created__lt=created)
+                    | Q(created=created, **{f'{id_field}__gt': pk}))
+        return list(queryset[:self.page_size + 1])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, None, False
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+            created = parse_datetime(position['c'])
+            pk = int(position['i'])
+            reverse = bool(position.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk, reverse
+
+    def encode_cursor(self, recipe, reverse):
+        position = {'c': recipe.created.isoformat(), 'i': recipe.pk}
+        if reverse:
+            position['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    '''
+    Keyset-пагинация ленты подписок. queryset - пара: записи ленты
+    пользователя (FeedEntry) и рецепты авторов, которые собираются
+    при чтении. Страница каждой части выбирается по тому же курсору,
+    части сливаются; на странице - позиции (created, pk) рецептов
+    '''
+    def check_ordering(self, queryset):
+        # Порядок ленты задает только курсор
+        pass
+
+    def fetch(self, queryset, created, pk, reverse):
+        entries, recipes = queryset
+        positions = {
+            entry.recipe_id: Position(entry.created, entry.recipe_id)
+            for entry in super().fetch(
+                entries.only('created', 'recipe_id'),
+                created, pk, reverse, 'recipe_id')
+        }
+        # Рецепт автора мог попасть в ленту до того,
+        # как у автора стало много подписчиков
+        positions.update(
+            (recipe.pk, Position(recipe.created, recipe.pk))
+            for recipe in super().fetch(
+                recipes.only('created'), created, pk, reverse)
+        )
+        results = sorted(
+            positions.values(),
+            key=lambda position: (position.created, -position.pk),
+            reverse=not reverse
+        )
+        return results[:self.page_size + 1]
@@ -0,0 +1,121 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .lru import LocalLRU
+from .middleware import track_serialization
+from .replicas import use_primary
+from .serializers import RecipePublicSerializer
+from recipes.models import Recipe, RecipeIngredient
+from recipes.versions import author_scope, get_versions, recipe_scope
+
+# Данные, от которых зависит публичное представление любого рецепта
+SHARED_SCOPES = ('tags', 'ingredients')
+
+
+class RecipeCache:
+    '''
+    Двухуровневый кэш публичной части представления рецепта:
+    LRU в памяти процесса перед общим кэшем Django.
+    В ключ входят версии рецепта, его автора и общих данных (теги,
+    ингредиенты), поэтому изменения из любого процесса делают
+    старые записи недостижимыми без явного удаления
+    '''
+    def __init__(self):
+        self.local = LocalLRU(settings.RECIPE_CACHE_SIZE)
+
+    def make_keys(self, request, authors):
+        scopes = list(dict.fromkeys(
+            scope for pk, author_id in authors.items()
+            for scope in (recipe_scope(pk), author_scope(author_id))
+        ))
+        versions = get_versions(*SHARED_SCOPES, *scopes)
+        shared = versions[:len(SHARED_SCOPES)]
+        versions = dict(zip(scopes, versions[len(SHARED_SCOPES):]))
+        base_url = request.build_absolute_uri('/')
+        keys = {}
+        for pk, author_id in authors.items():
+            recipe_version = versions[recipe_scope(pk)]
+            author_version = versions[author_scope(author_id)]
+            digest = hashlib.md5(
+                f'{base_url}:{shared}:{recipe_version}:{author_version}'
+                .encode()
+            ).hexdigest()
+            keys[pk] = f'recipe:{pk}:{digest}'
+        return keys
+
+    def get_public(self, request, authors):
+        '''
+        Публичные представления рецептов ({pk: представление}) по
+        словарю {pk: id автора}: из кэша или из БД. Рецептов, которых
+        уже нет в основной БД, в результате нет
+        '''
+        pks = list(authors)
+        keys = self.make_keys(request, authors)
+        found = self.local.get_many(keys.values())
+        missing = [key for key in keys.values() if key not in found]
+        if missing:
+            shared = cache.get_many(missing)
+            self.local.set_many(shared)
+            found.update(shared)
+        missing_pks = [pk for pk in pks if keys[pk] not in found]
+        if missing_pks:
+            # Запись в кэше живет до следующего изменения рецепта,
+            # поэтому читаем с основной БД: реплика может отставать
+            with use_primary():
+                recipes = Recipe.objects.filter(
+                    pk__in=missing_pks
+                ).select_related('author').prefetch_related(
+                    'tags',
+                    Prefetch(
+                        'ingr_in_rec',
+                        queryset=RecipeIngredient.objects.select_related(
+                            'ingredient')
+                    )
+                )
+                serializer = RecipePublicSerializer(
+                    recipes, many=True, context={'request': request})
+                rendered = {
+                    keys[item['id']]: item for item in serializer.data
+                }
+            self.local.set_many(rendered)
+            cache.set_many(rendered, timeout=settings.RECIPE_CACHE_TIMEOUT)
+            found.update(rendered)
+        return {pk: found[keys[pk]] for pk in pks if keys[pk] in found}
+
+    def represent(self, recipes, request):
+        '''
+        Полные представления рецептов: публичная часть из кэша
+        и флаги пользователя из аннотаций страницы. Рецепт, удаленный
+        после чтения страницы (в том числе с отстающей реплики),
+        пропускается
+        '''
+        recipes = list(recipes)
+        with track_serialization(request):
+            public = self.get_public(request, {
+                recipe.pk: recipe.author_id for recipe in recipes})
+            return [
+                with_user_state(public[recipe.pk], recipe)
+                for recipe in recipes if recipe.pk in public
+            ]
+
+
+def with_user_state(data, recipe):
+    '''
+    Накладывает на публичное представление флаги пользователя,
+    не изменяя закэшированный объект
+    '''
+    result = dict(data)
+    result['author'] = dict(
+        data['author'],
+        is_subscribed=getattr(recipe, 'author_is_subscribed', None)
+    )
+    result['is_favorited'] = getattr(recipe, 'is_favorited', None)
+    result['is_in_shopping_cart'] = getattr(
+        recipe, 'is_in_shopping_cart', None)
+    return result
+
+
+recipe_cache = RecipeCache()
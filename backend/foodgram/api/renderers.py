@@ -0,0 +1,120 @@
+import csv
+import json
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework.renderers import BaseRenderer
+
+PDF_FONT = 'ShoppingList'
+
+
+class Echo:
+    '''
+    Псевдо-файл для csv.writer: возвращает записанную строку
+    вместо её буферизации
+    '''
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    '''
+    Базовый класс форматов списка покупок.
+    Через ?format= выбирается формат файла, а stream() построчно
+    формирует его тело для StreamingHttpResponse
+    '''
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Используется только для ответов с ошибками
+        return json.dumps(data, ensure_ascii=False).encode(
+            self.charset or 'utf-8')
+
+    def stream(self, items):
+        raise NotImplementedError
+
+
+class TxtRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, items):
+        for item in items:
+            yield ' | '.join(map(str, item.values())) + '\n'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Единица измерения', 'Количество')
+
+    def stream(self, items):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for item in items:
+            yield writer.writerow(item.values())
+
+
+@lru_cache(maxsize=None)
+def pdf_font():
+    '''
+    Шрифт PDF_FONT_PATH, зарегистрированный в reportlab: встроенные
+    шрифты PDF не содержат кириллицы
+    '''
+    pdfmetrics.registerFont(TTFont(PDF_FONT, settings.PDF_FONT_PATH))
+    return PDF_FONT
+
+
+class PDFRenderer(ShoppingListRenderer):
+    '''
+    Список покупок в PDF. Строки читаются из БД по мере заполнения
+    страниц, но PDF заканчивается таблицей ссылок на все объекты
+    документа, поэтому файл собирается во временном файле (в памяти -
+    до spool_size байт) и отдается частями по chunk_size байт
+    '''
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    title = 'Список покупок'
+    font_size = 12
+    leading = 16
+    margin = 20 * mm
+    spool_size = 1024 * 1024
+    chunk_size = 64 * 1024
+
+    def stream(self, items):
+        # Шрифт - до начала ответа: без него ответ не начинается
+        return self.pages(items, pdf_font())
+
+    def pages(self, items, font):
+        spooled = SpooledTemporaryFile(max_size=self.spool_size)
+        pdf = Canvas(spooled, pagesize=A4)
+        pdf.setTitle(self.title)
+        width, height = A4
+        y = height - self.margin
+        pdf.setFont(font, self.font_size + 4)
+        pdf.drawString(self.margin, y, self.title)
+        y -= 2 * self.leading
+        pdf.setFont(font, self.font_size)
+        for item in items:
+            lines = simpleSplit(
+                ' | '.join(map(str, item.values())),
+                font, self.font_size, width - 2 * self.margin)
+            for line in lines:
+                if y < self.margin:
+                    pdf.showPage()
+                    pdf.setFont(font, self.font_size)
+                    y = height - self.margin
+                pdf.drawString(self.margin, y, line)
+                y -= self.leading
+        pdf.save()
+        spooled.seek(0)
+        with spooled:
+            yield from iter(lambda: spooled.read(self.chunk_size), b'')
@@ -0,0 +1,127 @@
+import hashlib
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PIN_KEY = 'replica-pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Модели, которые всегда читаются с основной БД: токен, созданный
+# при входе, может еще не дойти до реплики
+PRIMARY_MODELS = ('authtoken.Token',)
+# Отставание реплики в секундах: 0, если все полученные изменения
+# применены (иначе на простаивающей основной БД оно бы росло)
+LAG_SQL = '''
+    SELECT COALESCE(CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END, 0)
+'''
+
+request_state = ContextVar('request_state', default=None)
+
+
+class RequestState:
+    '''
+    Что известно роутеру о текущем запросе к API
+    '''
+    def __init__(self, request):
+        self.safe = request.method in SAFE_METHODS
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        self.pin_key = None
+        if authorization:
+            self.pin_key = PIN_KEY.format(
+                hashlib.md5(authorization.encode()).hexdigest())
+        self.replica = None
+        self._pinned = None
+        self._wrote = False
+
+    def is_pinned(self):
+        '''
+        Клиент недавно писал в БД и должен видеть свои изменения
+        '''
+        if self._pinned is None:
+            self._pinned = bool(self.pin_key and cache.get(self.pin_key))
+        return self._pinned
+
+    def pin(self):
+        if self.pin_key and not self._wrote:
+            self._wrote = True
+            cache.set(self.pin_key, 1, settings.REPLICA_PIN_TIMEOUT)
+
+
+@contextmanager
+def use_primary():
+    '''
+    Чтение с основной БД внутри блока, например для данных,
+    которые надолго попадают в общий кэш
+    '''
+    token = request_state.set(None)
+    try:
+        yield
+    finally:
+        request_state.reset(token)
+
+
+class ReplicaRouter:
+    '''
+    Чтение в безопасных запросах к API - с реплик из DB_REPLICA_HOSTS,
+    запись, транзакции и все остальное - с основной БД.
+    Клиент, который писал в БД, читает с основной БД еще
+    REPLICA_PIN_TIMEOUT секунд. Реплика, отставшая больше чем на
+    REPLICA_MAX_LAG секунд или недоступная, пропускается
+    '''
+    def __init__(self):
+        self.replicas = [
+            alias for alias in settings.DATABASES
+            if alias.startswith('replica')
+        ]
+        self._health = {}
+
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        if (not self.replicas or state is None or not state.safe
+                or model._meta.label in PRIMARY_MODELS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block
+                or state.is_pinned()):
+            return None
+        # Все чтения одного запроса - с одной реплики
+        if state.replica is None:
+            replicas = [
+                alias for alias in self.replicas if self.is_healthy(alias)
+            ]
+            state.replica = random.choice(replicas) if replicas else ''
+        return state.replica or None
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            state.pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+    def is_healthy(self, alias):
+        checked_at, healthy = self._health.get(alias, (None, False))
+        now = time.monotonic()
+        if (checked_at is not None
+                and now - checked_at < settings.REPLICA_CHECK_INTERVAL):
+            return healthy
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+            healthy = lag <= settings.REPLICA_MAX_LAG
+        except DatabaseError:
+            healthy = False
+        self._health[alias] = (now, healthy)
+        return healthy
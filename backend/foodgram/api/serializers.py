@@ -2,20 +2,35 @@ from rest_framework import serializers
 from rest_framework.fields import CurrentUserDefault
 from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.validators import ValidationError
-from drf_extra_fields.fields import Base64ImageField
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
 
+from .fields import ImageVariantsField, RecipeImageField
+from recipes.cart import change_recipe
 from recipes.models import (
     Tag,
     Recipe,
     Ingredient,
-    RecipeIngredient
+    RecipeIngredient,
+    CartTotal
 )
 
 User = get_user_model()
 
 
+def subscribed_ids(user):
+    '''
+    id авторов, на которых подписан пользователь, для контекста
+    сериализаторов: загружаются одним запросом при первом обращении
+    '''
+    if not user.is_authenticated:
+        return frozenset()
+    return SimpleLazyObject(lambda: set(
+        user.subscribing.values_list('author_id', flat=True)))
+
+
 class UserSerializer(serializers.ModelSerializer):
     '''
     Сериализатор модели User
@@ -28,9 +43,17 @@ class UserSerializer(serializers.ModelSerializer):
                   'first_name', 'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
-        if user.is_authenticated:
-            return user.subscribing.filter(author=obj).exists()
+        if not user.is_authenticated:
+            return None
+        # На себя подписаться нельзя
+        if obj.pk == user.pk:
+            return False
+        if 'subscribed_ids' in self.context:
+            return obj.pk in self.context['subscribed_ids']
+        return user.subscribing.filter(author=obj).exists()
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -56,11 +79,12 @@ class RecipeShortSerializer(serializers.ModelSerializer):
     Сериализатор модели Recipe (краткая версия):
     используется для представления рецепта вкратце
     '''
-    image = Base64ImageField()
+    image = RecipeImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'cooking_time', 'image')
+        fields = ('id', 'name', 'cooking_time', 'image', 'images')
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
@@ -88,21 +112,27 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(many=True, source='ingr_in_rec')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'name', 'text', 'image',
+        fields = ('tags', 'author', 'name', 'text', 'image', 'images',
                   'cooking_time', 'id', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart')
 
-    # Методы для SerializerMethodField
+    # Методы для SerializerMethodField: флаги - из аннотаций
+    # RecipeViewSet.get_queryset, запрос - только если их нет
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return user.favorite.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return user.shopping_cart.filter(recipe=obj).exists()
@@ -126,9 +156,48 @@ class RecipeSerializer(serializers.ModelSerializer):
         if len(ingredients_unique_checklist) != (
            len(set(ingredients_unique_checklist))):
             raise ValidationError('Ингредиенты не могут повторятся!')
+
+        # Проверка "существуют ли ингредиенты": один запрос на все id,
+        # дальше вместо id используются найденные объекты
+        ingredients = Ingredient.objects.in_bulk(ingredients_unique_checklist)
+        missing = [
+            str(ingredient_id)
+            for ingredient_id in ingredients_unique_checklist
+            if ingredient_id not in ingredients
+        ]
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}')
+        for ingredient in data['ingr_in_rec']:
+            ingredient['ingredient'] = ingredients[
+                ingredient['ingredient']['id']]
         return data
 
 
+class AuthorSerializer(UserSerializer):
+    '''
+    Сериализатор автора рецепта без данных текущего пользователя
+    '''
+    is_subscribed = None
+
+    class Meta(UserSerializer.Meta):
+        fields = ('id', 'username', 'email', 'first_name', 'last_name')
+
+
+class RecipePublicSerializer(RecipeSerializer):
+    '''
+    Сериализатор модели Recipe без флагов текущего пользователя:
+    его результат кэшируется и общий для всех пользователей
+    '''
+    author = AuthorSerializer()
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeSerializer.Meta):
+        fields = ('tags', 'author', 'name', 'text', 'image', 'images',
+                  'cooking_time', 'id', 'ingredients')
+
+
 class RecipeWriteSerializer(RecipeSerializer):
     '''
     Сериализатор модели Recipe (для записи рецепта)
@@ -143,7 +212,7 @@ class RecipeWriteSerializer(RecipeSerializer):
         '''
         rec_ingr_list = [
             RecipeIngredient(
-                ingredient_id=ingredient['ingredient']['id'],
+                ingredient=ingredient['ingredient'],
                 amount=ingredient['amount'],
                 recipe=recipe,
             )
@@ -158,31 +227,86 @@ class RecipeWriteSerializer(RecipeSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.set_ingredients(recipe, ingredients)
+        # Нового рецепта еще нет ни в избранном, ни в корзинах
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        '''
+        Приводит ингредиенты рецепта к переданным: удаляет, изменяет
+        и создает только отличающиеся записи RecipeIngredient
+        '''
+        current = {
+            rec_ingr.ingredient_id: rec_ingr
+            for rec_ingr in recipe.ingr_in_rec.all()
+        }
+        submitted = {
+            ingredient['ingredient'].id: ingredient
+            for ingredient in ingredients
+        }
+        # Разница количеств - для итогов корзин с этим рецептом:
+        # bulk-операции не отправляют сигналы, удаление - отправляет
+        deltas = {}
+        removed = current.keys() - submitted.keys()
+        if removed:
+            recipe.ingr_in_rec.filter(ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, rec_ingr in current.items():
+            ingredient = submitted.get(ingredient_id)
+            if ingredient and rec_ingr.amount != ingredient['amount']:
+                deltas[ingredient_id] = ingredient['amount'] - rec_ingr.amount
+                rec_ingr.amount = ingredient['amount']
+                changed.append(rec_ingr)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = [
+            ingredient for ingredient_id, ingredient in submitted.items()
+            if ingredient_id not in current
+        ]
+        if added:
+            self.set_ingredients(recipe, added)
+            for ingredient in added:
+                deltas[ingredient['ingredient'].id] = ingredient['amount']
+        if deltas:
+            change_recipe(recipe.pk, deltas)
+
     @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingr_in_rec')
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
+        # set() сам добавляет недостающие и удаляет лишние теги
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.set_ingredients(instance, ingredients)
-        instance.save()
+        self.update_ingredients(instance, ingredients)
         return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'ingr_in_rec',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
         return RecipeSerializer(instance=instance, context=context).data
 
 
+class CartTotalSerializer(RecipeIngredientSerializer):
+    '''
+    Сериализатор модели CartTotal: итог ингредиента в корзине покупок
+    '''
+    class Meta(RecipeIngredientSerializer.Meta):
+        model = CartTotal
+
+
 class SubscribtionsSerializer(UserSerializer):
     '''
     Сериализатор модели Subscribtions
     '''
-    recipes_count = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -191,14 +315,25 @@ class SubscribtionsSerializer(UserSerializer):
                   'last_name', 'is_subscribed', 'recipes_count', )
 
     # Методы для SerializerMethodField
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
         request = self.context.get('request')
         context = {'request': request}
-        recipes_limit = request.query_params.get('recipes_limit')
-        limit = int(recipes_limit) if recipes_limit else None
-        limited_recipes = obj.recipes.all()[:limit]
+        if hasattr(obj, 'limited_recipes'):
+            limited_recipes = obj.limited_recipes
+        else:
+            recipes_limit = request.query_params.get('recipes_limit')
+            limit = int(recipes_limit) if recipes_limit else None
+            limited_recipes = obj.recipes.all()[:limit]
         return RecipeShortSerializer(
             limited_recipes, context=context, many=True).data
+
+
+class BatchSerializer(serializers.Serializer):
+    '''
+    Список id для пакетных операций с избранным, корзиной и подписками
+    '''
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_tokens
+
+User = get_user_model()
+
+
+# Кэш токенов: пользователь в нем должен быть актуальным
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    # У нового пользователя еще нет токена
+    if created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    keys = list(
+        Token.objects.filter(user=instance).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: forget_tokens(*keys))
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_tokens(instance.key))
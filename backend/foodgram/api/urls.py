@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_patterns
 from .views import (
     TagViewSet,
     RecipeViewSet,
@@ -21,3 +23,6 @@ urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
 ]
+
+if settings.ASYNC_API:
+    urlpatterns = async_patterns(urlpatterns)
@@ -1,18 +1,50 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.filters import OrderingFilter
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.contrib.auth import get_user_model
 from djoser.views import UserViewSet
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value
+)
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .pagination import CustomPagination
-from .filters import RecipesFilter, IngredientSearchFilter
+from .batch import batch_response
+from .conditional import conditional
+from .pagination import (
+    CustomPagination,
+    FeedCursorPagination,
+    RecipeCursorPagination
+)
+from .filters import (
+    IngredientSearchFilter,
+    RecipeOrderingFilter,
+    RecipesFilter
+)
+from .middleware import serializer_data
 from .permissions import IsAuthorOrReadOnly
+from .recipe_cache import recipe_cache
+from .renderers import (
+    CSVRenderer,
+    PDFRenderer,
+    ShoppingListRenderer,
+    TxtRenderer
+)
+from recipes.cart import cart_totals
+from recipes.feed import feed_sources
+from recipes.ingredient_index import ingredient_index
+from recipes.similar import similar_index
 from recipes.models import (
     Tag,
     Ingredient,
@@ -22,6 +54,8 @@ from recipes.models import (
     Subscriptions
 )
 from .serializers import (
+    BatchSerializer,
+    CartTotalSerializer,
     TagSerializer,
     IngredientSerializer,
     RecipeWriteSerializer,
@@ -29,7 +63,7 @@ from .serializers import (
     RecipeShortSerializer,
     SubscribtionsSerializer,
     UserSerializer,
-    RecipeIngredient
+    subscribed_ids
 )
 
 User = get_user_model()
@@ -42,10 +76,29 @@ class CustomUserViewSet(UserViewSet):
     def get_serializer_class(self):
         if self.action in ('subscribe', 'subscriptions'):
             return SubscribtionsSerializer
+        if self.action == 'subscribe_batch':
+            return BatchSerializer
         if self.action in ('me', 'get', 'list', 'retrieve'):
             return UserSerializer
         return super().get_serializer_class()
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Страницы списка - по первичному ключу
+            queryset = queryset.order_by('id')
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscriptions.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['subscribed_ids'] = subscribed_ids(self.request.user)
+        return context
+
     @action(methods=['post', 'delete'], detail=True)
     def subscribe(self, request, *args, **kwargs):
         id = kwargs.get('id')
@@ -62,8 +115,9 @@ class CustomUserViewSet(UserViewSet):
                 return Response(
                     {'error': 'Уже подписаны'},
                     status=status.HTTP_409_CONFLICT)
+            author.is_subscribed = True
             serializer = self.get_serializer(author)
-            return Response(serializer.data)
+            return Response(serializer_data(request, serializer))
 
         if request.method == 'DELETE':
             subscribed = get_object_or_404(
@@ -71,39 +125,190 @@ class CustomUserViewSet(UserViewSet):
             subscribed.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='subscribe/batch')
+    def subscribe_batch(self, request):
+        '''
+        Подписка на авторов и отписка от них по списку id
+        '''
+        return batch_response(
+            request, Subscriptions, 'author_id', User.objects.all(),
+            excluded={request.user.pk})
+
     @action(methods=['get'], detail=False)
     def subscriptions(self, request):
+        '''
+        Авторы, на которых подписан пользователь: страница выбирается
+        в БД, превью рецептов всей страницы - одним запросом
+        '''
         user = request.user
-        subscribtions = User.objects.filter(subscribed__user=user)
+        recipes_limit = request.query_params.get('recipes_limit')
+        limit = int(recipes_limit) if recipes_limit else None
+        recipes = Recipe.objects.all()
+        if limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')).values('pk')[:limit]
+            ))
+        subscribtions = User.objects.filter(
+            subscribed__user=user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        ).order_by('id')
+        page = self.paginate_queryset(subscribtions)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(
+                serializer_data(request, serializer))
         serializer = self.get_serializer(subscribtions, many=True)
-        queryset = self.paginate_queryset(serializer.data)
-        return self.get_paginated_response(queryset)
+        return Response(serializer_data(request, serializer))
 
 
+@method_decorator(conditional('tags'), name='list')
+@method_decorator(conditional('tags'), name='retrieve')
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
+@method_decorator(conditional('ingredients'), name='list')
+@method_decorator(conditional('ingredients'), name='retrieve')
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientSearchFilter
 
+    def list(self, request, *args, **kwargs):
+        # Поиск по началу названия обслуживается индексом в памяти
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
+
 
+RECIPE_SCOPES = ('recipes', 'tags', 'ingredients', 'user')
+# Счетчики меняются через update() без сигналов и версий данных
+COUNTER_FIELDS = ('favorites_count', 'shopping_cart_count')
+
+
+def orders_by_counters(request):
+    ordering = request.GET.get(RecipeOrderingFilter.ordering_param, '')
+    return any(
+        field.strip().lstrip('-') in COUNTER_FIELDS
+        for field in ordering.split(',')
+    )
+
+
+@method_decorator(
+    conditional(*RECIPE_SCOPES, unless=orders_by_counters), name='list')
+@method_decorator(conditional(*RECIPE_SCOPES), name='retrieve')
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, OrderingFilter)
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipesFilter
+    ordering_fields = ('id', 'name', 'cooking_time', 'created',
+                       *COUNTER_FIELDS)
     ordering = ('-created',)
 
+    @property
+    def paginator(self):
+        # Keyset-пагинация включается параметром ?cursor,
+        # у ленты подписок она всегда
+        if not hasattr(self, '_paginator'):
+            if self.action == 'feed':
+                self._paginator = FeedCursorPagination()
+            elif (
+                self.action == 'list'
+                and RecipeCursorPagination.cursor_query_param
+                in self.request.query_params
+            ):
+                self._paginator = RecipeCursorPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        '''
+        Для списков и retrieve флаги пользователя выбираются
+        аннотациями вместе со страницей, остальное берется из recipe_cache
+        '''
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'feed', 'similar'):
+            return queryset
+        queryset = queryset.only('id', 'author_id', 'created')
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                author_is_subscribed=Exists(Subscriptions.objects.filter(
+                    user=user, author=OuterRef('author'))),
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                recipe_cache.represent(page, request))
+        return Response(recipe_cache.represent(queryset, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        represented = recipe_cache.represent([recipe], request)
+        if not represented:
+            raise NotFound
+        return Response(represented[0])
+
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        '''
+        Рецепты авторов, на которых подписан пользователь, от новых
+        к старым. Страницы - по ?cursor из ссылок next и previous
+        '''
+        page = self.paginate_queryset(feed_sources(request.user))
+        page = self.in_order([position.pk for position in page])
+        return self.get_paginated_response(
+            recipe_cache.represent(page, request))
+
+    def in_order(self, ids):
+        '''
+        Рецепты с флагами пользователя в порядке ids
+        '''
+        recipes = self.get_queryset().in_bulk(ids)
+        return [recipes[pk] for pk in ids if pk in recipes]
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk):
+        '''
+        Рецепты, похожие на этот по ингредиентам и тегам
+        (recipes.similar), не больше ?limit
+        '''
+        if not pk.isdigit():
+            raise NotFound
+        limit = RecipeCursorPagination().get_page_size(request)
+        ids = similar_index.search(int(pk), limit)
+        if ids is None:
+            # В индексе только рецепты с ингредиентами
+            get_object_or_404(Recipe, pk=pk)
+            ids = []
+        return Response(recipe_cache.represent(self.in_order(ids), request))
+
     def get_serializer_class(self):
         if self.action in ('favorite', 'shopping_cart'):
             return RecipeShortSerializer
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('favorite_batch', 'shopping_cart_batch'):
+            return BatchSerializer
+        if self.action == 'shopping_cart_totals':
+            return CartTotalSerializer
+        if self.action in ('list', 'retrieve', 'feed', 'similar'):
             return RecipeSerializer
         return RecipeWriteSerializer
 
@@ -119,7 +324,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 {'error': 'Рецепт уже добавлен'},
                 status=status.HTTP_409_CONFLICT)
         serializer = self.get_serializer(recipe)
-        return Response(serializer.data)
+        return Response(serializer_data(self.request, serializer))
 
     def delete_recipe(self, Model, recipe, user):
         '''
@@ -146,20 +351,62 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.add_recipe(ShoppingCart, recipe, user)
         return self.delete_recipe(ShoppingCart, recipe, user)
 
-    @action(methods=['get'], detail=False)
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='favorite/batch')
+    def favorite_batch(self, request):
+        '''
+        Добавление в избранное и удаление из него по списку id рецептов
+        '''
+        return batch_response(
+            request, Favorite, 'recipe_id', Recipe.objects.all())
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart/batch')
+    def shopping_cart_batch(self, request):
+        '''
+        Добавление в корзину и удаление из нее по списку id рецептов
+        '''
+        return batch_response(
+            request, ShoppingCart, 'recipe_id', Recipe.objects.all())
+
+    @action(methods=['get'], detail=False, url_path='shopping_cart/totals',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_totals(self, request):
+        '''
+        Сколько каждого ингредиента нужно по рецептам корзины покупок
+        '''
+        totals = cart_totals(request.user).select_related('ingredient')
+        return Response(serializer_data(
+            request, self.get_serializer(totals, many=True)))
+
+    @action(
+        methods=['get'],
+        detail=False,
+        renderer_classes=(TxtRenderer, CSVRenderer, PDFRenderer, JSONRenderer),
+        permission_classes=(IsAuthenticated,)
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping_cart = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=user).values(
+        '''
+        Список покупок в формате ?format=txt|csv|pdf (по умолчанию txt)
+        из итогов корзины (CartTotal). Строки отдаются потоком по мере
+        чтения из БД
+        '''
+        shopping_cart = cart_totals(request.user).values(
             'ingredient__name',
-            'ingredient__measurement_unit').annotate(
-            total_amount=Sum("amount"))
-        shopping_list = [
-            " | ".join(map(str, string.values())) for string in shopping_cart
-        ]
-        shopping_list_file = "\n".join(map(str, shopping_list))
-        response = HttpResponse(shopping_list_file, content_type='text/plain')
+            'ingredient__measurement_unit',
+            total_amount=F('amount')
+        )
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, ShoppingListRenderer):
+            renderer = TxtRenderer()
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(shopping_cart.iterator()),
+            content_type=content_type
+        )
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_list.txt"'
+            f'attachment; filename="shopping_list.{renderer.format}"'
         )
         return response
@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Под ASGI горячие эндпоинты чтения обслуживаются асинхронными
+# представлениями (api.async_views)
+os.environ.setdefault('ASYNC_API', '1')
 
-application = get_asgi_application()
+# Как django.core.asgi.get_asgi_application, но потоковые ответы
+# формируются в пуле потоков
+django.setup(set_prefix=False)
+
+from api.async_views import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
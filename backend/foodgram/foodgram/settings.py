@@ -17,6 +17,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'django_filters',
@@ -24,11 +25,14 @@ INSTALLED_APPS = [
     'djoser',
     'colorfield',
 
+    'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'users.apps.UsersConfig',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +74,46 @@ DATABASES = {
     }
 }
 
+# Локальный запуск без PostgreSQL (например, для бенчмарков)
+if os.getenv('DB_ENGINE') == 'sqlite3':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    }
+
+# Реплики для чтения: DB_REPLICA_HOSTS=host[:port], host[:port]
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = dict(
+        DATABASES['default'],
+        HOST=host,
+        PORT=port or DATABASES['default']['PORT'],
+        OPTIONS={'connect_timeout': 2},
+        TEST={'MIRROR': 'default'}
+    )
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Клиент, писавший в БД, читает с основной БД столько секунд;
+# реплики с большим отставанием (в секундах) пропускаются,
+# отставание проверяется раз в REPLICA_CHECK_INTERVAL секунд
+REPLICA_PIN_TIMEOUT = int(os.getenv('REPLICA_PIN_TIMEOUT', 10))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+
+# Общий для всех процессов кэш (memcached в docker-compose):
+# в нем хранятся версии данных для ETag/Last-Modified
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -112,12 +156,67 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
 AUTH_USER_MODEL = 'users.User'
 DJOSER = {'HIDE_USERS': False}
 
+# Как часто (в секундах) индекс ингредиентов перечитывается из БД
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Как часто (в секундах) индекс похожих рецептов перестраивается в фоне
+SIMILAR_INDEX_TTL = int(os.getenv('SIMILAR_INDEX_TTL', 300))
+
+# Загрузка картинок рецептов: предельный размер файла в байтах,
+# число фоновых потоков и формат уменьшенных копий (WEBP или JPEG)
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', 5 * 1024 ** 2))
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+
+# Список покупок в PDF: TTF-шрифт с кириллицей
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Кэш представлений рецептов: записей в памяти процесса
+# и время жизни записи в общем кэше (в секундах)
+RECIPE_CACHE_SIZE = int(os.getenv('RECIPE_CACHE_SIZE', 1000))
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Лента подписок: рецепты авторов, у которых подписчиков больше
+# FEED_FANOUT_LIMIT, не раскладываются по лентам, а добираются при
+# чтении; новый подписчик получает столько последних рецептов автора
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_BACKFILL_SIZE = int(os.getenv('FEED_BACKFILL_SIZE', 50))
+
+# Кэш проверки токенов: время жизни записи в общем кэше
+# и в памяти процесса (в секундах), записей в памяти процесса
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 60))
+TOKEN_CACHE_LOCAL_TIMEOUT = int(os.getenv('TOKEN_CACHE_LOCAL_TIMEOUT', 10))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 5000))
+
+# Асинхронные представления API (включаются в foodgram/asgi.py)
+# и число потоков процесса для обращений к БД из них
+ASYNC_API = os.getenv('ASYNC_API') == '1'
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 20))
+
+# Замеры запросов: доля запросов к API, попадающих в лог,
+# и порог (в миллисекундах) и доля записей лога медленных SQL-запросов
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', 0.01))
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', 100))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_SAMPLE_RATE', 1))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -32,12 +32,9 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'name', 'favorite_counter')
+    list_display = ('id', 'author', 'name', 'favorites_count')
     list_filter = ('name', 'author', 'tags')
-
-    @admin.display(description='Добавлений в избранное')
-    def favorite_counter(self, obj):
-        return obj.in_favorite.count()
+    list_select_related = ('author',)
 
     inlines = (
         IngredientInline,
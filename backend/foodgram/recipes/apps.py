@@ -4,3 +4,21 @@ from django.apps import AppConfig
 class RecipesConfig(AppConfig):
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .cart import fill_cart_totals
+        from .counters import fill_counters
+        from .feed import fill_feed
+        from .search import create_search_indexes
+        from .tag_mask import fill_tags
+
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(fill_tags, sender=self)
+        post_migrate.connect(fill_counters, sender=self)
+        post_migrate.connect(fill_cart_totals, sender=self)
+        # После пересчета счетчиков: по ним выбираются авторы
+        # с раскладкой рецептов при записи
+        post_migrate.connect(fill_feed, sender=self)
@@ -0,0 +1,123 @@
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .models import CartTotal, RecipeIngredient, ShoppingCart
+
+# Итоги корзины покупок (CartTotal) меняются на разницу одним
+# запросом (PostgreSQL и SQLite): параллельные изменения корзины одного
+# пользователя не теряются. Прибавление - INSERT ... ON CONFLICT DO
+# UPDATE, вычитание меняет только существующие итоги: при удалении
+# пользователя или ингредиента их итоги удаляются раньше корзин и
+# ингредиентов рецептов. Строки с нулевым итогом не удаляются,
+# а пропускаются при чтении: их не больше, чем ингредиентов,
+# которые были в корзине
+
+# Остаток после вычитания дробных количеств, который считается нулем
+EPSILON = 1e-6
+
+UPSERT_SQL = '''
+    INSERT INTO {totals} (user_id, ingredient_id, amount)
+    {select}
+    ON CONFLICT (user_id, ingredient_id)
+    DO UPDATE SET amount = {totals}.amount + excluded.amount
+'''
+
+UPDATE_SQL = '''
+    UPDATE {totals} SET amount = {totals}.amount + changes.amount
+    FROM ({select}) changes
+    WHERE {totals}.user_id = changes.user_id
+    AND {totals}.ingredient_id = changes.ingredient_id
+'''
+
+
+def change_totals(select, params, subtract):
+    '''
+    Прибавляет к итогам строки (user_id, ingredient_id, amount)
+    запроса select; при subtract все amount отрицательные
+    '''
+    sql = UPDATE_SQL if subtract else UPSERT_SQL
+    sql = sql.format(totals=CartTotal._meta.db_table, select=select)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def change_cart(user_id, recipe_ids, sign):
+    '''
+    Прибавляет (sign=1) к итогам корзины пользователя ингредиенты
+    рецептов recipe_ids или вычитает (sign=-1) их
+    '''
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    change_totals(
+        f'SELECT %s AS user_id, ingredient_id, SUM(amount) * %s AS amount '
+        f'FROM {RecipeIngredient._meta.db_table} '
+        f'WHERE recipe_id IN ({placeholders}) '
+        f'GROUP BY ingredient_id',
+        [user_id, sign, *recipe_ids],
+        subtract=sign < 0
+    )
+
+
+def change_recipe(recipe_id, deltas):
+    '''
+    Изменение ингредиентов рецепта deltas ({id ингредиента: разница
+    количества}) - в итоги корзин всех пользователей, у кого он в корзине
+    '''
+    for subtract in (False, True):
+        changed = [
+            (ingredient_id, delta) for ingredient_id, delta in deltas.items()
+            if delta and (delta < 0) == subtract
+        ]
+        if not changed:
+            continue
+        changes = ' UNION ALL '.join(
+            ['SELECT %s AS ingredient_id, %s AS amount'] * len(changed))
+        change_totals(
+            f'SELECT cart.user_id, changed.ingredient_id, changed.amount '
+            f'FROM {ShoppingCart._meta.db_table} cart, ({changes}) changed '
+            f'WHERE cart.recipe_id = %s',
+            [*(value for change in changed for value in change), recipe_id],
+            subtract
+        )
+
+
+def cart_totals(user):
+    return CartTotal.objects.filter(
+        user=user, amount__gt=EPSILON).order_by('ingredient__name')
+
+
+def rebuild_totals(using='default', batch_size=5000):
+    '''
+    Итоги всех корзин заново по корзинам и ингредиентам рецептов.
+    Возвращает число записей итогов
+    '''
+    with transaction.atomic(using):
+        CartTotal.objects.using(using).all().delete()
+        totals = RecipeIngredient.objects.using(using).filter(
+            recipe__in_shopping_cart__isnull=False
+        ).values_list(
+            'recipe__in_shopping_cart__user', 'ingredient'
+        ).annotate(amount=Sum('amount')).order_by()
+        batch = []
+        count = 0
+        for user_id, ingredient_id, amount in totals.iterator():
+            batch.append(CartTotal(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount))
+            if len(batch) >= batch_size:
+                CartTotal.objects.using(using).bulk_create(batch)
+                count += len(batch)
+                batch = []
+        CartTotal.objects.using(using).bulk_create(batch)
+        return count + len(batch)
+
+
+def fill_cart_totals(sender, using, **kwargs):
+    '''
+    Обработчик post_migrate: итоги для корзин, собранных до появления
+    таблицы итогов. Без них список покупок был бы пуст, а удаление
+    рецепта из корзины увело бы итоги ниже нуля
+    '''
+    if (
+        not CartTotal.objects.using(using).exists()
+        and ShoppingCart.objects.using(using).exists()
+    ):
+        rebuild_totals(using)
@@ -0,0 +1,77 @@
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, Recipe, ShoppingCart, Subscriptions
+
+User = get_user_model()
+
+# Счетчики популярности: модель -> {поле-счетчик: (модель связи,
+# поле связи)}. При записи их обновляют сигналы (recipes.signals)
+COUNTED = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'shopping_cart_count': (ShoppingCart, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Subscriptions, 'author'),
+    },
+}
+
+
+def count_of(model, field):
+    '''
+    Подзапрос: количество записей model, ссылающихся на объект
+    '''
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def recount(using='default'):
+    '''
+    Пересчитывает счетчики, разошедшиеся с данными.
+    Возвращает число исправленных записей каждой модели
+    '''
+    fixed = {}
+    for model, fields in COUNTED.items():
+        actual = {
+            f'actual_{counter}': count_of(related_model, field)
+            for counter, (related_model, field) in fields.items()
+        }
+        drifted = list(
+            model.objects.using(using).annotate(**actual).filter(
+                reduce(or_, (
+                    ~Q(**{counter: F(f'actual_{counter}')})
+                    for counter in fields
+                ))
+            ).values_list('pk', flat=True)
+        )
+        if drifted:
+            model.objects.using(using).filter(pk__in=drifted).update(**{
+                counter: count_of(related_model, field)
+                for counter, (related_model, field) in fields.items()
+            })
+        fixed[model] = len(drifted)
+    return fixed
+
+
+def fill_counters(sender, using, **kwargs):
+    '''
+    Обработчик post_migrate: счетчики для существующих данных.
+    Новые поля-счетчики создаются с нулем, и без пересчета
+    первое же удаление связи увело бы счетчик ниже нуля
+    '''
+    recount(using)
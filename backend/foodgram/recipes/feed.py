@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import FeedEntry, Recipe, Subscriptions
+
+User = get_user_model()
+
+# Лента подписок. Рецепты авторов, у которых не больше
+# FEED_FANOUT_LIMIT подписчиков, раскладываются по лентам подписчиков
+# при записи (FeedEntry). Рецепты остальных авторов лента добирает
+# при чтении: рассылка каждого из них заняла бы слишком много строк
+
+
+def fan_out(recipe):
+    '''
+    Новый рецепт - в ленты подписчиков автора
+    '''
+    followers_count = User.objects.filter(
+        pk=recipe.author_id).values_list('followers_count', flat=True).first()
+    if not followers_count or followers_count > settings.FEED_FANOUT_LIMIT:
+        return
+    followers = Subscriptions.objects.filter(
+        author_id=recipe.author_id).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe.pk,
+                author_id=recipe.author_id,
+                created=recipe.created
+            ) for user_id in followers
+        ],
+        ignore_conflicts=True
+    )
+
+
+def backfill(subscriptions):
+    '''
+    Последние FEED_BACKFILL_SIZE рецептов автора - в ленту нового
+    подписчика. Рецепты выбираются по запросу на автора: каждый
+    читает по индексу не больше FEED_BACKFILL_SIZE строк
+    '''
+    followers = {}
+    for subscription in subscriptions:
+        followers.setdefault(subscription.author_id, []).append(
+            subscription.user_id)
+    authors = User.objects.filter(
+        pk__in=followers, followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).values_list('pk', flat=True)
+    entries = []
+    for author_id in authors:
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            '-created').values_list('pk', 'created')
+        entries.extend(
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                created=created
+            )
+            for recipe_id, created in recipes[:settings.FEED_BACKFILL_SIZE]
+            for user_id in followers[author_id]
+        )
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def refill(author_ids):
+    '''
+    Рецепты авторов, у которых подписчиков стало ровно
+    FEED_FANOUT_LIMIT, - снова в ленты всех их подписчиков: рецепты,
+    опубликованные, пока подписчиков было больше, лента добирала
+    при чтении, а теперь перестанет
+    '''
+    authors = User.objects.filter(
+        pk__in=author_ids, followers_count=settings.FEED_FANOUT_LIMIT)
+    if authors.exists():
+        backfill(Subscriptions.objects.filter(author__in=authors))
+
+
+def forget(subscriptions):
+    '''
+    Рецепты авторов - из лент отписавшихся пользователей:
+    запрос на подписчика
+    '''
+    authors = {}
+    for subscription in subscriptions:
+        authors.setdefault(subscription.user_id, []).append(
+            subscription.author_id)
+    for user_id, author_ids in authors.items():
+        FeedEntry.objects.filter(
+            user_id=user_id, author_id__in=author_ids).delete()
+
+
+def feed_sources(user):
+    '''
+    Лента пользователя: его записи FeedEntry и рецепты авторов
+    с большим числом подписчиков, на которых он подписан
+    (пагинация - api.pagination.FeedCursorPagination)
+    '''
+    return (
+        FeedEntry.objects.filter(user=user),
+        Recipe.objects.filter(author__in=User.objects.filter(
+            subscribed__user=user,
+            followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ))
+    )
+
+
+def rebuild(using='default', batch_size=5000):
+    '''
+    Ленты всех подписчиков заново по подпискам: последние рецепты
+    каждого автора с раскладкой при записи. Возвращает число записей
+    '''
+    fanned_out = {
+        'author__followers_count__gt': 0,
+        'author__followers_count__lte': settings.FEED_FANOUT_LIMIT,
+    }
+    with transaction.atomic(using):
+        FeedEntry.objects.using(using).all().delete()
+        latest = {}
+        recipes = Recipe.objects.using(using).filter(**fanned_out).order_by(
+            'author_id', '-created').values_list('pk', 'author_id', 'created')
+        for recipe_id, author_id, created in recipes.iterator():
+            author_recipes = latest.setdefault(author_id, [])
+            if len(author_recipes) < settings.FEED_BACKFILL_SIZE:
+                author_recipes.append((recipe_id, created))
+
+        batch = []
+        count = 0
+        subscriptions = Subscriptions.objects.using(using).filter(
+            **fanned_out).values_list('user_id', 'author_id')
+        for user_id, author_id in subscriptions.iterator():
+            for recipe_id, created in latest.get(author_id, ()):
+                batch.append(FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    created=created
+                ))
+            if len(batch) >= batch_size:
+                FeedEntry.objects.using(using).bulk_create(batch)
+                count += len(batch)
+                batch = []
+        FeedEntry.objects.using(using).bulk_create(batch)
+        return count + len(batch)
+
+
+def fill_feed(sender, using, **kwargs):
+    '''
+    Обработчик post_migrate: ленты для подписок, оформленных
+    до появления таблицы лент
+    '''
+    if (
+        not FeedEntry.objects.using(using).exists()
+        and Subscriptions.objects.using(using).exists()
+    ):
+        rebuild(using)
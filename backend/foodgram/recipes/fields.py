@@ -0,0 +1,12 @@
+from django.contrib.postgres.fields import ArrayField
+
+
+class PostgresArrayField(ArrayField):
+    '''
+    Массив PostgreSQL. В остальных СУБД столбец не заполняется
+    и остается NULL, а значение передается без приведения типа
+    '''
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor != 'postgresql':
+            return '%s'
+        return super().get_placeholder(value, compiler, connection)
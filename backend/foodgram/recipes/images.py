@@ -0,0 +1,94 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+from .versions import bump_version, recipe_scope
+
+logger = logging.getLogger(__name__)
+
+# Варианты картинки рецепта: наибольшая сторона в пикселях
+IMAGE_VARIANTS = {
+    'thumb': 320,
+    'card': 640,
+    'full': 1280,
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def needs_variants(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name
+    )
+
+
+def schedule_variants(recipe):
+    '''
+    Ставит обработку картинки в фоновый пул после коммита транзакции
+    '''
+    recipe_id = recipe.pk
+    image_name = recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(make_variants, recipe_id, image_name))
+
+
+def encode_variant(image, size):
+    variant = image.copy()
+    variant.thumbnail((size, size))
+    image_format = settings.RECIPE_IMAGE_FORMAT
+    if variant.mode not in ('RGB', 'RGBA') or image_format == 'JPEG':
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    # Метаданные (EXIF и пр.) не передаются и в файл не попадают
+    variant.save(buffer, format=image_format, quality=80)
+    return buffer.getvalue()
+
+
+def make_variants(recipe_id, image_name):
+    '''
+    Уменьшенные копии картинки рецепта без метаданных.
+    Выполняется в фоновом потоке
+    '''
+    try:
+        with default_storage.open(image_name) as image_file:
+            image = Image.open(image_file)
+            image = ImageOps.exif_transpose(image)
+        extension = settings.RECIPE_IMAGE_FORMAT.lower()
+        stem = PurePosixPath(image_name).stem
+        variants = {'source': image_name}
+        for name, size in IMAGE_VARIANTS.items():
+            variants[name] = default_storage.save(
+                f'media/variants/{stem}_{name}.{extension}',
+                ContentFile(encode_variant(image, size))
+            )
+        old_variants = Recipe.objects.filter(
+            pk=recipe_id).values_list('image_variants', flat=True).first()
+        # Картинку могли заменить, пока шла обработка
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=image_name
+        ).update(image_variants=variants)
+        if updated:
+            stale, keep = old_variants or {}, variants
+            bump_version('recipes', recipe_scope(recipe_id))
+        else:
+            stale, keep = variants, {}
+        for name in IMAGE_VARIANTS:
+            path = stale.get(name)
+            if path and path != keep.get(name):
+                default_storage.delete(path)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать картинку рецепта %s', recipe_id)
+    finally:
+        connection.close()
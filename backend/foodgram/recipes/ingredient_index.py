@@ -0,0 +1,143 @@
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value):
+    '''
+    Приводит название к виду для поиска: нижний регистр, ё -> е
+    '''
+    return value.lower().replace('ё', 'е')
+
+
+def item(ingredient):
+    return {
+        'name': ingredient.name,
+        'measurement_unit': ingredient.measurement_unit,
+        'id': ingredient.pk,
+    }
+
+
+def changed(index, pk, ingredient=None):
+    '''
+    Копия индекса без ингредиента pk и с ingredient, если он передан
+    '''
+    keys, items = list(index[0]), dict(index[1])
+    removed = items.pop(pk, None)
+    if removed is not None:
+        keys.remove((normalize(removed['name']), pk))
+    if ingredient is not None:
+        bisect.insort(keys, (normalize(ingredient.name), pk))
+        items[pk] = item(ingredient)
+    return tuple(keys), items
+
+
+class IngredientIndex:
+    '''
+    Отсортированный индекс названий ингредиентов в памяти процесса:
+    поиск по началу названия без обращения к БД.
+    Строится при первом запросе, изменения из этого процесса
+    применяются сигналами, изменения из других процессов подхватываются
+    перестроением в фоне раз в INGREDIENT_INDEX_TTL секунд.
+    Индекс - пара (ключи, ингредиенты), которая не изменяется, а
+    заменяется целиком: поиск читает ее один раз и без блокировки
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Первое построение - одно на все запросы, которые его ждут
+        self._build_lock = threading.Lock()
+        self._index = ((), {})
+        self._built_at = None
+        self._building = False
+        # Изменения во время построения: применяются и к новому индексу
+        self._changes = []
+
+    def build(self):
+        with self._lock:
+            self._building = True
+            self._changes = []
+        keys = []
+        items = {}
+        ingredients = Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit')
+        for pk, name, measurement_unit in ingredients.iterator():
+            keys.append((normalize(name), pk))
+            items[pk] = {
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'id': pk,
+            }
+        keys.sort()
+        index = (tuple(keys), items)
+        with self._lock:
+            for pk, ingredient in self._changes:
+                index = changed(index, pk, ingredient)
+            self._index = index
+            self._changes = []
+            self._built_at = time.monotonic()
+            self._building = False
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс ингредиентов')
+            with self._lock:
+                self._building = False
+        finally:
+            connection.close()
+
+    def _refresh_stale(self):
+        with self._lock:
+            if self._building or (
+                time.monotonic() - self._built_at
+                <= settings.INGREDIENT_INDEX_TTL
+            ):
+                return
+            self._building = True
+        threading.Thread(
+            target=self._rebuild, name='ingredient-index', daemon=True
+        ).start()
+
+    def search(self, prefix):
+        '''
+        Ингредиенты, название которых начинается с prefix
+        '''
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.build()
+        else:
+            self._refresh_stale()
+        key = normalize(prefix)
+        keys, items = self._index
+        result = []
+        position = bisect.bisect_left(keys, (key,))
+        while position < len(keys) and keys[position][0].startswith(key):
+            result.append(items[keys[position][1]])
+            position += 1
+        return result
+
+    def _change(self, pk, ingredient=None):
+        with self._lock:
+            if self._building:
+                self._changes.append((pk, ingredient))
+            if self._built_at is not None:
+                self._index = changed(self._index, pk, ingredient)
+
+    def update(self, ingredient):
+        self._change(ingredient.pk, ingredient)
+
+    def delete(self, pk):
+        self._change(pk)
+
+
+ingredient_index = IngredientIndex()
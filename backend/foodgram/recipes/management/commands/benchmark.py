@@ -0,0 +1,403 @@
+import base64
+import io
+import logging
+import math
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import local_tokens
+from api.recipe_cache import recipe_cache
+from recipes.models import Ingredient, Recipe, Tag
+from .generate_data import PASSWORD
+
+User = get_user_model()
+
+# setup выполняется перед замером, undo - после него, оба не замеряются:
+# это запрос (метод, URL, данные, auth) или функция от команды.
+# В URL и данных подставляются значения из Command.get_context,
+# {created} - id из ответа на предыдущий запрос,
+# {unique} - свое значение на каждой итерации.
+# budget - закрепленное число SQL-запросов ко всем БД (наибольшее
+# на SQLite и PostgreSQL на момент изменения эндпоинта), без запаса:
+# любой рост - регрессия, которую исправляют или закрепляют новым
+# бюджетом. Если число запросов растет с размером пачки, budget -
+# функция контекста: k + N
+Endpoint = namedtuple(
+    'Endpoint',
+    ('name', 'method', 'url', 'budget', 'data', 'setup', 'undo', 'auth'),
+    defaults=(None, None, None, True)
+)
+
+RECIPE_DATA = {
+    'name': 'Бенчмарк',
+    'text': 'Рецепт для замера',
+    'cooking_time': 10,
+    'image': '{image}',
+    'tags': ['{tag}'],
+    'ingredients': [{'id': '{ingredient}', 'amount': 10}],
+}
+PATCH_DATA = {
+    key: value for key, value in RECIPE_DATA.items() if key != 'image'
+}
+BATCH_DATA = {'ids': '{batch}'}
+AUTHORS_DATA = {'ids': '{authors}'}
+LOGIN_DATA = {'email': '{email}', 'password': '{password}'}
+NEW_PASSWORD = 'benchmark-changed'
+USER_DATA = {
+    'email': 'new{unique}@example.com',
+    'username': 'new{unique}',
+    'first_name': 'Бенчмарк',
+    'last_name': 'Пользователь',
+    'password': NEW_PASSWORD,
+}
+SET_PASSWORD_DATA = {
+    'current_password': '{password}',
+    'new_password': NEW_PASSWORD,
+}
+RESET_PASSWORD_DATA = {
+    'current_password': NEW_PASSWORD,
+    'new_password': '{password}',
+}
+
+
+def delete_created_user(command):
+    # Удалить пользователя через API может только он сам
+    User.objects.filter(pk=command.context['created']).delete()
+
+
+# Бюджет - наибольшее допустимое число SQL-запросов на один запрос к API
+# с холодным кэшем (--cold), с теплым кэшем запросов обычно меньше
+ENDPOINTS = (
+    Endpoint('tags', 'get', '/api/tags/', 2),
+    Endpoint('tag', 'get', '/api/tags/{tag}/', 2),
+    Endpoint('ingredients', 'get', '/api/ingredients/', 2),
+    Endpoint('ingredients search', 'get',
+             '/api/ingredients/?name={ingredient_prefix}', 1),
+    Endpoint('ingredient', 'get', '/api/ingredients/{ingredient}/', 2),
+    Endpoint('recipes anonymous', 'get', '/api/recipes/?limit=6', 5,
+             auth=False),
+    Endpoint('recipes', 'get', '/api/recipes/?limit=6', 6),
+    Endpoint('recipes deep page', 'get',
+             '/api/recipes/?limit=6&page={deep_page}', 6),
+    Endpoint('recipes cursor', 'get', '/api/recipes/?limit=6&cursor=', 5),
+    Endpoint('recipes by tags', 'get',
+             '/api/recipes/?limit=6&tags={tag_slug}&tags={other_tag_slug}',
+             7),
+    Endpoint('recipes by all tags', 'get',
+             '/api/recipes/?limit=6&all_tags={tag_slug}'
+             '&all_tags={other_tag_slug}', 7),
+    Endpoint('recipes by author', 'get',
+             '/api/recipes/?limit=6&author={author}', 7),
+    Endpoint('recipes favorited', 'get',
+             '/api/recipes/?limit=6&is_favorited=1', 6),
+    Endpoint('recipes in cart', 'get',
+             '/api/recipes/?limit=6&is_in_shopping_cart=1', 6),
+    Endpoint('recipes search', 'get',
+             '/api/recipes/?limit=6&search={search}', 6),
+    Endpoint('recipes popular', 'get',
+             '/api/recipes/?limit=6&ordering=-favorites_count', 6),
+    Endpoint('recipe', 'get', '/api/recipes/{recipe}/', 6),
+    Endpoint('similar', 'get', '/api/recipes/{recipe}/similar/', 5),
+    Endpoint('feed', 'get', '/api/recipes/feed/?limit=6', 7),
+    Endpoint('shopping list txt', 'get',
+             '/api/recipes/download_shopping_cart/', 2),
+    Endpoint('shopping list csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', 2),
+    Endpoint('shopping cart totals', 'get',
+             '/api/recipes/shopping_cart/totals/', 2),
+    Endpoint('users', 'get', '/api/users/?limit=6', 3),
+    Endpoint('user', 'get', '/api/users/{author}/', 2),
+    Endpoint('me', 'get', '/api/users/me/', 1),
+    Endpoint('subscriptions', 'get',
+             '/api/users/subscriptions/?limit=6&recipes_limit=3', 4),
+    Endpoint('recipe create', 'post', '/api/recipes/', 18,
+             data=RECIPE_DATA, undo=('delete', '/api/recipes/{created}/')),
+    Endpoint('recipe update', 'patch', '/api/recipes/{created}/', 13,
+             data=PATCH_DATA,
+             setup=('post', '/api/recipes/', RECIPE_DATA),
+             undo=('delete', '/api/recipes/{created}/')),
+    Endpoint('recipe replace', 'put', '/api/recipes/{created}/', 13,
+             data=RECIPE_DATA,
+             setup=('post', '/api/recipes/', RECIPE_DATA),
+             undo=('delete', '/api/recipes/{created}/')),
+    Endpoint('recipe delete', 'delete', '/api/recipes/{created}/', 13,
+             setup=('post', '/api/recipes/', RECIPE_DATA)),
+    Endpoint('favorite add', 'post', '/api/recipes/{recipe}/favorite/', 6,
+             undo=('delete', '/api/recipes/{recipe}/favorite/')),
+    Endpoint('favorite delete', 'delete',
+             '/api/recipes/{recipe}/favorite/', 6,
+             setup=('post', '/api/recipes/{recipe}/favorite/')),
+    Endpoint('shopping cart add', 'post',
+             '/api/recipes/{recipe}/shopping_cart/', 7,
+             undo=('delete', '/api/recipes/{recipe}/shopping_cart/')),
+    Endpoint('shopping cart delete', 'delete',
+             '/api/recipes/{recipe}/shopping_cart/', 7,
+             setup=('post', '/api/recipes/{recipe}/shopping_cart/')),
+    Endpoint('favorite batch add', 'post', '/api/recipes/favorite/batch/',
+             6, data=BATCH_DATA,
+             undo=('delete', '/api/recipes/favorite/batch/', BATCH_DATA)),
+    Endpoint('favorite batch delete', 'delete',
+             '/api/recipes/favorite/batch/', 5, data=BATCH_DATA,
+             setup=('post', '/api/recipes/favorite/batch/', BATCH_DATA)),
+    Endpoint('shopping cart batch add', 'post',
+             '/api/recipes/shopping_cart/batch/', 7, data=BATCH_DATA,
+             undo=('delete', '/api/recipes/shopping_cart/batch/',
+                   BATCH_DATA)),
+    Endpoint('shopping cart batch delete', 'delete',
+             '/api/recipes/shopping_cart/batch/', 6, data=BATCH_DATA,
+             setup=('post', '/api/recipes/shopping_cart/batch/',
+                    BATCH_DATA)),
+    Endpoint('subscribe', 'post', '/api/users/{author}/subscribe/', 10,
+             undo=('delete', '/api/users/{author}/subscribe/')),
+    Endpoint('unsubscribe', 'delete', '/api/users/{author}/subscribe/', 8,
+             setup=('post', '/api/users/{author}/subscribe/')),
+    # Лента: запрос последних рецептов на каждого автора
+    Endpoint('subscribe batch', 'post', '/api/users/subscribe/batch/',
+             lambda context: 11 + len(context['authors']),
+             data=AUTHORS_DATA,
+             undo=('delete', '/api/users/subscribe/batch/', AUTHORS_DATA)),
+    Endpoint('unsubscribe batch', 'delete', '/api/users/subscribe/batch/',
+             7, data=AUTHORS_DATA,
+             setup=('post', '/api/users/subscribe/batch/', AUTHORS_DATA)),
+    Endpoint('user create', 'post', '/api/users/', 4, data=USER_DATA,
+             undo=delete_created_user, auth=False),
+    Endpoint('set password', 'post', '/api/users/set_password/', 4,
+             data=SET_PASSWORD_DATA,
+             undo=('post', '/api/users/set_password/', RESET_PASSWORD_DATA)),
+    Endpoint('token login', 'post', '/api/auth/token/login/', 3,
+             data=LOGIN_DATA, auth=False),
+    # Выход удаляет токен: undo входит снова и получает новый
+    Endpoint('token logout', 'post', '/api/auth/token/logout/', 4,
+             undo=('post', '/api/auth/token/login/', LOGIN_DATA, False)),
+)
+
+
+@contextmanager
+def capture_queries():
+    '''
+    CaptureQueriesContext для каждой БД: основной и реплик.
+    Недоступная реплика запросов не получает и пропускается
+    '''
+    with ExitStack() as stack:
+        captured = []
+        for alias in connections:
+            try:
+                captured.append(stack.enter_context(
+                    CaptureQueriesContext(connections[alias])))
+            except DatabaseError:
+                pass
+        yield captured
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def fill(value, context):
+    '''
+    Подставляет значения контекста в строки URL и данных запроса
+    '''
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, context) for item in value]
+    if isinstance(value, str):
+        if value.startswith('{') and value.endswith('}'):
+            # Значение целиком: сохраняем тип (число, список)
+            return context.get(value[1:-1], value)
+        return value.format(**context)
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency percentiles and SQL query counts of API '
+        'endpoints and fail when a query budget is exceeded'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username', default='bench0',
+            help='Пользователь, от имени которого выполняются запросы')
+        parser.add_argument(
+            '--password', default=PASSWORD,
+            help='Пароль пользователя: для входа и смены пароля')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument(
+            '--only', metavar='TEXT',
+            help='Замерять только эндпоинты, в названии которых есть TEXT')
+        parser.add_argument(
+            '--exclude', metavar='TEXT',
+            help='Пропустить эндпоинты, в названии которых есть TEXT')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэши перед каждым запросом')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть больше 0')
+        self.cold = options['cold']
+        self.prepare(options['username'], options['password'])
+        endpoints = self.select_endpoints(options['only'], options['exclude'])
+        self.stdout.write(
+            f'{connection.vendor}, итераций: {options["iterations"]}'
+            f'{", холодный кэш" if self.cold else ""}\n'
+            f'{"эндпоинт":<28}{"p50, мс":>9}{"p95, мс":>9}{"p99, мс":>9}'
+            f'{"max, мс":>9}{"SQL":>5}{"бюджет":>8}'
+        )
+        over_budget = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for endpoint in endpoints:
+                timings, queries = self.measure(
+                    endpoint, options['warmup'], options['iterations'])
+                budget = self.budget(endpoint)
+                line = (
+                    f'{endpoint.name:<28}'
+                    f'{percentile(timings, 50):>9.1f}'
+                    f'{percentile(timings, 95):>9.1f}'
+                    f'{percentile(timings, 99):>9.1f}'
+                    f'{max(timings):>9.1f}'
+                    f'{queries:>5}{budget:>8}'
+                )
+                if queries > budget:
+                    over_budget.append(endpoint.name)
+                    line = self.style.ERROR(line)
+                self.stdout.write(line)
+        if over_budget:
+            raise CommandError(
+                f'Превышен бюджет SQL-запросов: {", ".join(over_budget)}')
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
+
+    def prepare(self, username, password=PASSWORD):
+        '''
+        Контекст подстановок и клиенты API: с токеном пользователя
+        username и анонимный
+        '''
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(
+                f'Пользователь {username} не найден, '
+                'создайте данные командой generate_data')
+        # Строка лога на каждый запрос только мешает читать таблицу
+        logging.getLogger('api.timing').setLevel(logging.WARNING)
+        self.context = self.get_context(user)
+        self.context['password'] = password
+        token, _ = Token.objects.get_or_create(user=user)
+        self.clients = {True: APIClient(), False: APIClient()}
+        self.clients[True].credentials(
+            HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def budget(self, endpoint):
+        if callable(endpoint.budget):
+            return endpoint.budget(self.context)
+        return endpoint.budget
+
+    def select_endpoints(self, only, exclude):
+        return [
+            endpoint for endpoint in ENDPOINTS
+            if (not only or only in endpoint.name)
+            and not (exclude and exclude in endpoint.name)
+        ]
+
+    def clear_caches(self):
+        cache.clear()
+        recipe_cache.local.clear()
+        local_tokens.clear()
+
+    def get_context(self, user):
+        recipes = Recipe.objects.exclude(author=user).exclude(
+            in_favorite__user=user).exclude(in_shopping_cart__user=user)
+        recipe = recipes.order_by('pk').first()
+        authors = User.objects.exclude(pk=user.pk).exclude(
+            subscribed__user=user)
+        author = authors.filter(recipes__isnull=False).first()
+        tags = list(Tag.objects.order_by('pk')[:2])
+        ingredient = Ingredient.objects.order_by('pk').first()
+        if not (recipe and author and tags and ingredient):
+            raise CommandError(
+                'Недостаточно данных, создайте их командой generate_data')
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), 'green').save(image, 'PNG')
+        return {
+            'recipe': recipe.pk,
+            'author': author.pk,
+            'tag': tags[0].pk,
+            'tag_slug': tags[0].slug,
+            'other_tag_slug': tags[-1].slug,
+            'ingredient': ingredient.pk,
+            'ingredient_prefix': ingredient.name[:2],
+            'search': recipe.name.split()[0],
+            'deep_page': max(Recipe.objects.count() // 6 // 2, 1),
+            'batch': list(recipes.order_by('pk').values_list(
+                'pk', flat=True)[:20]),
+            'authors': list(authors.order_by('pk').values_list(
+                'pk', flat=True)[:20]),
+            'email': user.email,
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(image.getvalue()).decode(),
+            'created': None,
+        }
+
+    def request(self, method, url, data=None, auth=True):
+        response = getattr(self.clients[auth], method)(
+            fill(url, self.context), fill(data, self.context), format='json')
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {response.request["PATH_INFO"]}: '
+                f'{response.status_code} {response.content[:200]}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elif isinstance(response.data, dict):
+            if 'id' in response.data:
+                self.context['created'] = response.data['id']
+            if 'auth_token' in response.data:
+                # После выхода вход выдает новый токен
+                self.clients[True].credentials(
+                    HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+        return response
+
+    def run(self, step):
+        if callable(step):
+            step(self)
+        else:
+            self.request(*step)
+
+    def measure(self, endpoint, warmup, iterations):
+        '''
+        Время ответа каждой итерации в миллисекундах
+        и наибольшее число SQL-запросов за итерацию
+        '''
+        timings = []
+        max_queries = 0
+        for iteration in range(warmup + iterations):
+            self.context['unique'] = time.time_ns()
+            if endpoint.setup:
+                self.run(endpoint.setup)
+            if self.cold:
+                self.clear_caches()
+            with capture_queries() as queries:
+                started = time.perf_counter()
+                self.request(
+                    endpoint.method, endpoint.url, endpoint.data,
+                    endpoint.auth)
+                elapsed = (time.perf_counter() - started) * 1000
+            # Журнал запросов очищается в начале следующего запроса к API
+            query_count = sum(len(captured) for captured in queries)
+            if endpoint.undo:
+                self.run(endpoint.undo)
+            if iteration >= warmup:
+                timings.append(elapsed)
+                max_queries = max(max_queries, query_count)
+        return timings, max_queries
@@ -0,0 +1,130 @@
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from .benchmark import Command as BenchmarkCommand, capture_queries
+
+INDEX_SCANS = {'Index Scan', 'Index Only Scan'}
+# Узлы, которые читают весь свой вход до первой строки результата:
+# Limit над ними не ограничивает чтение
+BLOCKING = {'Aggregate', 'Sort', 'Hash', 'SetOp', 'WindowAgg'}
+
+# Справочники: небольшие таблицы, которые можно читать целиком
+# без условия (список тегов, соединение с ингредиентами рецептов)
+DICTIONARIES = {'recipes_tag', 'recipes_ingredient'}
+
+
+def whole_table_scans(node, parent=None, bounded=False):
+    '''
+    (таблица, тип узла) для каждого лишнего чтения таблицы целиком
+    в узле плана и его потомках. Целиком читают последовательное
+    чтение и чтение индекса без условия (Index Cond), кроме чтения
+    индекса под Limit: оно останавливается на первых строках.
+    Чтение целиком с отбором строк (Filter) - всегда лишнее, без
+    отбора - допустимо для справочников и для подсчета всех строк
+    таблицы (COUNT(*) для пагинации)
+    '''
+    node_type = node['Node Type']
+    if node.get('Parent Relationship') in ('InitPlan', 'SubPlan'):
+        bounded = False
+    whole = node_type == 'Seq Scan' or (
+        node_type in INDEX_SCANS and 'Index Cond' not in node
+        and not bounded
+    )
+    if whole and (
+        'Filter' in node
+        or node['Relation Name'] not in DICTIONARIES and not (
+            parent is not None and parent['Node Type'] == 'Aggregate'
+            and len(parent['Plans']) == 1
+        )
+    ):
+        yield node['Relation Name'], node_type
+    if node_type == 'Limit':
+        bounded = True
+    elif node_type in BLOCKING:
+        bounded = False
+    for child in node.get('Plans', ()):
+        yield from whole_table_scans(child, node, bounded)
+
+
+class Command(BenchmarkCommand):
+    help = (
+        'Run EXPLAIN for every SQL query of read API endpoints against '
+        'PostgreSQL and fail when a plan reads a whole table: '
+        'a sequential scan or an index scan without an index condition'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username', default='bench0',
+            help='Пользователь, от имени которого выполняются запросы')
+        parser.add_argument(
+            '--only', metavar='TEXT',
+            help='Проверять только эндпоинты, в названии которых есть TEXT')
+        parser.add_argument(
+            '--exclude', metavar='TEXT',
+            help='Пропустить эндпоинты, в названии которых есть TEXT')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Планы запросов проверяются на PostgreSQL')
+        self.verbosity = options['verbosity']
+        self.prepare(options['username'])
+        endpoints = [
+            endpoint for endpoint in self.select_endpoints(
+                options['only'], options['exclude'])
+            if endpoint.method == 'get'
+        ]
+        self.stdout.write(
+            f'{"эндпоинт":<24}{"SQL":>5}  чтение таблиц целиком')
+        regressions = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for endpoint in endpoints:
+                count, scans = self.full_scans(endpoint)
+                line = f'{endpoint.name:<24}{count:>5}  '
+                if scans:
+                    regressions.append(endpoint.name)
+                    line = self.style.ERROR(line + ', '.join(sorted(scans)))
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                'Чтение таблиц целиком в планах запросов: '
+                f'{", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Все запросы читают по индексам'))
+
+    def full_scans(self, endpoint):
+        '''
+        Число SELECT-запросов эндпоинта и таблицы,
+        которые они читают целиком
+        '''
+        # Первый запрос строит индексы в памяти процесса (ингредиенты,
+        # похожие рецепты), второй, с пустыми кэшами, - проверяемый
+        self.request(endpoint.method, endpoint.url, auth=endpoint.auth)
+        self.clear_caches()
+        with capture_queries() as queries:
+            self.request(endpoint.method, endpoint.url, auth=endpoint.auth)
+        # Реплики повторяют схему основной БД: планы берутся с нее
+        selects = [
+            query['sql'] for captured in queries for query in captured
+            if query['sql'].startswith('SELECT')
+        ]
+        scans = set()
+        for sql in selects:
+            if self.verbosity > 1:
+                self.stdout.write(f'{sql}\n{self.explain(sql)}\n')
+            plan = self.explain(sql, 'FORMAT JSON')[0]['Plan']
+            scans.update(
+                f'{table} ({node_type})'
+                for table, node_type in whole_table_scans(plan)
+            )
+        return len(selects), scans
+
+    def explain(self, sql, options=''):
+        # Без enable_seqscan последовательное чтение остается в плане,
+        # только если подходящего индекса нет: проверка не зависит
+        # от объема тестовых данных
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN ({options or "FORMAT TEXT"}) {sql}')
+            rows = [row[0] for row in cursor.fetchall()]
+        return rows[0] if options else '\n'.join(rows)
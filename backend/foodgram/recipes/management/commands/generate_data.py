@@ -0,0 +1,189 @@
+import io
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Subscriptions,
+    Tag
+)
+from recipes.search import update_search_vector
+from recipes.tag_mask import update_tags, without_tags
+from recipes.versions import bump_version
+
+User = get_user_model()
+
+PASSWORD = 'benchmark'
+IMAGE_NAME = 'media/benchmark.png'
+DISHES = (
+    'суп', 'борщ', 'салат', 'пирог', 'омлет', 'рагу', 'плов', 'каша',
+    'запеканка', 'паста', 'блины', 'котлеты', 'соус', 'десерт', 'хлеб',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'зимний', 'острый', 'сладкий',
+    'постный', 'праздничный', 'простой', 'бабушкин', 'овощной', 'рыбный',
+)
+WORDS = (
+    'нарезать', 'смешать', 'добавить', 'варить', 'жарить', 'запекать',
+    'минут', 'соль', 'перец', 'масло', 'духовка', 'сковорода', 'подавать',
+    'горячим', 'холодным', 'зелень', 'тесто', 'начинка', 'огонь', 'крышка',
+)
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Рецептов в избранном у каждого пользователя')
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Рецептов в корзине у каждого пользователя')
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Подписок у каждого пользователя')
+        parser.add_argument(
+            '--prefix', default='bench',
+            help='Префикс имен создаваемых пользователей')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix или очистите базу')
+        if options['users'] < 1 or options['recipes'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь и рецепт')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        # Ингредиенты и теги - из настоящих файлов проекта
+        call_command('import_csv', stdout=self.stdout)
+        self.tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('pk', flat=True))
+
+        user_ids = self.create_users(prefix, options['users'])
+        recipe_ids = self.create_recipes(user_ids, options['recipes'])
+        self.create_links(
+            Favorite, 'recipe_id', user_ids, recipe_ids,
+            options['favorites'])
+        self.create_links(
+            ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+            options['cart'])
+        self.create_links(
+            Subscriptions, 'author_id', user_ids, user_ids,
+            options['subscriptions'])
+
+        # bulk_create не отправляет сигналы: счетчики, поисковый
+        # вектор и версии данных обновляются после генерации
+        call_command('recount_counters', stdout=self.stdout)
+        call_command('rebuild_feed', stdout=self.stdout)
+        call_command('rebuild_cart_totals', stdout=self.stdout)
+        update_search_vector(Recipe.objects.filter(search_vector=None))
+        update_tags(without_tags(Recipe.objects.all()))
+        bump_version('tags', 'ingredients', 'recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {time.monotonic() - started:.0f} с. '
+            f'Пользователи: {prefix}0..{prefix}{len(user_ids) - 1}, '
+            f'пароль: {PASSWORD}'
+        ))
+
+    def bulk_create(self, model, objects):
+        '''
+        Создает объекты пачками, не держа в памяти весь список
+        '''
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+
+    def create_users(self, prefix, count):
+        # Хэш пароля один на всех: его вычисление - самая медленная часть
+        password = make_password(PASSWORD)
+        self.bulk_create(User, (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password
+            ) for number in range(count)
+        ))
+        # На SQLite bulk_create не возвращает pk, читаем их из базы
+        user_ids = dict(User.objects.filter(
+            username__startswith=prefix).values_list('username', 'pk'))
+        return [user_ids[f'{prefix}{number}'] for number in range(count)]
+
+    def create_recipes(self, user_ids, count):
+        image = io.BytesIO()
+        Image.new('RGB', (640, 480), 'orange').save(image, 'PNG')
+        image_name = default_storage.save(
+            IMAGE_NAME, ContentFile(image.getvalue()))
+        # Число рецептов у авторов распределено по закону Ципфа:
+        # у первых пользователей их много, у большинства - единицы
+        weights = [1 / rank for rank in range(1, len(user_ids) + 1)]
+        authors = self.random.choices(user_ids, weights, k=count)
+        first_id = Recipe.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        self.bulk_create(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=(
+                    f'{self.random.choice(ADJECTIVES).capitalize()} '
+                    f'{self.random.choice(DISHES)} {number}'
+                ),
+                text=' '.join(self.random.choices(WORDS, k=30)),
+                cooking_time=self.random.randint(5, 180),
+                image=image_name
+            ) for number, author_id in enumerate(authors)
+        ))
+        recipe_ids = list(Recipe.objects.filter(
+            pk__gt=first_id).order_by('pk').values_list('pk', flat=True))
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.sample(self.tag_ids, 1, 3)
+        ))
+        self.bulk_create(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=self.random.randint(1, 500)
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(self.ingredient_ids, 3, 10)
+        ))
+        return recipe_ids
+
+    def create_links(self, model, field, user_ids, target_ids, per_user):
+        self.bulk_create(model, (
+            model(user_id=user_id, **{field: target_id})
+            for user_id in user_ids
+            for target_id in self.sample(target_ids, per_user, per_user)
+            if target_id != user_id or field != 'author_id'
+        ))
+
+    def sample(self, population, low, high):
+        count = min(self.random.randint(low, high), len(population))
+        return self.random.sample(population, count)
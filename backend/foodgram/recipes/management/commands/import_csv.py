@@ -1,39 +1,145 @@
 import csv
+import time
+from contextlib import nullcontext
+from itertools import islice
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient, Tag
+from recipes.versions import bump_version
 
 
 class Command(BaseCommand):
-    help = 'Import data from CSV file into Django models'
+    help = 'Import data from CSV files into Django models'
     csv_path = (
         Path(__file__).resolve().parent.parent.parent.parent / 'data'
     )
-    file_names = ('ingredients.csv', 'tags.csv')
+    # Для каждой модели: файл по умолчанию, колонки CSV,
+    # поля-ключ для поиска существующих записей и обновляемые поля
+    sources = {
+        'ingredients': {
+            'model': Ingredient,
+            'file_name': 'ingredients.csv',
+            'columns': ('name', 'measurement_unit'),
+            'key': ('name', 'measurement_unit'),
+            'update_fields': (),
+        },
+        'tags': {
+            'model': Tag,
+            'file_name': 'tags.csv',
+            'columns': ('name', 'color', 'slug'),
+            'key': ('slug',),
+            'update_fields': ('name', 'color'),
+        },
+    }
 
-    def handle(self, *args, **options):
-        # Имортируем данные из csv-файлов в соответствующие модели
-        for file in self.file_names:
-            csv_file_path = self.csv_path / file
-            with open(csv_file_path, 'r', encoding='utf-8') as csv_file:
-                csv_reader = csv.reader(csv_file)
-                for row in csv_reader:
-                    if file == 'ingredients.csv':
-                        instance = Ingredient(
-                            name=row[0],
-                            measurement_unit=row[1]
-                        )
-                        instance.save()
-
-                    elif file == 'tags.csv':
-                        instance = Tag(
-                            name=row[0],
-                            color=row[1],
-                            slug=row[2]
-                        )
-                        instance.save()
-
-            self.stdout.write(
-                self.style.SUCCESS(f'{file} imported successfully!')
+    def add_arguments(self, parser):
+        for source in self.sources:
+            parser.add_argument(
+                f'--{source}',
+                metavar='PATH',
+                help=f'Путь к CSV-файлу ({source})'
             )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной пачке записи в БД'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Прочитать файлы и посчитать изменения без записи в БД'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        # Без явно указанных файлов импортируем данные из каталога data
+        paths = {
+            source: options[source] for source in self.sources
+            if options[source]
+        } or {
+            source: self.csv_path / spec['file_name']
+            for source, spec in self.sources.items()
+        }
+        # В режиме dry-run все изменения откатываются в конце
+        with transaction.atomic() if options['dry_run'] else nullcontext():
+            for source, path in paths.items():
+                self.import_file(
+                    self.sources[source], Path(path), options['batch_size'])
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.WARNING(
+                    'Dry run: изменения не сохранены'))
+                return
+        # bulk_create не отправляет сигналы, версии обновляем явно
+        bump_version(*paths)
+
+    def read_rows(self, spec, csv_file):
+        '''
+        Построчно читает CSV, пропуская строки с неверным числом колонок
+        '''
+        columns = spec['columns']
+        for line_number, row in enumerate(csv.reader(csv_file), start=1):
+            if len(row) != len(columns):
+                self.stderr.write(
+                    f'{csv_file.name}:{line_number}: пропущена строка {row}')
+                continue
+            yield dict(zip(columns, (value.strip() for value in row)))
+
+    def import_file(self, spec, path, batch_size):
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден')
+        model = spec['model']
+        count_before = model.objects.count()
+        rows_total = 0
+        updated_total = 0
+        started = time.monotonic()
+        with open(path, 'r', encoding='utf-8') as csv_file:
+            rows = self.read_rows(spec, csv_file)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    updated_total += self.upsert(spec, batch)
+                rows_total += len(batch)
+        elapsed = time.monotonic() - started
+        created_total = model.objects.count() - count_before
+        rate = rows_total / elapsed if elapsed else rows_total
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name} imported successfully! '
+            f'Строк: {rows_total}, создано: {created_total}, '
+            f'обновлено: {updated_total}, {rate:.0f} строк/с'
+        ))
+
+    def upsert(self, spec, batch):
+        '''
+        Обновляет существующие записи пачки и создает недостающие,
+        повторный импорт того же файла не создает дубликатов.
+        Возвращает число обновленных записей
+        '''
+        model = spec['model']
+        key = spec['key']
+        update_fields = spec['update_fields']
+        rows = {tuple(row[field] for field in key): row for row in batch}
+        updated = []
+        if update_fields:
+            # Обновляемые модели ищутся по ключу из одного уникального поля
+            existing = model.objects.filter(**{
+                f'{key[0]}__in': [row_key[0] for row_key in rows]
+            })
+            for instance in existing:
+                row = rows.pop(
+                    tuple(getattr(instance, field) for field in key))
+                for field in update_fields:
+                    setattr(instance, field, row[field])
+                updated.append(instance)
+            model.objects.bulk_update(updated, update_fields)
+        model.objects.bulk_create(
+            (model(**row) for row in rows.values()),
+            ignore_conflicts=True
+        )
+        return len(updated)
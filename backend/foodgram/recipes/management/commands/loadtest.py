@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark import percentile
+
+# Горячие эндпоинты чтения
+PATHS = (
+    '/api/recipes/?limit=6',
+    '/api/recipes/?limit=6&page=2',
+    '/api/tags/',
+    '/api/ingredients/?name=мо',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running server with concurrent requests and report '
+        'throughput and latency percentiles (compare WSGI and ASGI)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Путь запроса, можно указать несколько раз')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--token', help='Токен для авторизации')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('Нужен хотя бы один запрос и поток')
+        paths = options['paths'] or PATHS
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        local = threading.local()
+
+        def send(number):
+            # У каждого потока свое keep-alive соединение
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers.update(headers)
+            url = options['url'] + paths[number % len(paths)]
+            started = time.perf_counter()
+            try:
+                status = local.session.get(url).status_code
+            except requests.RequestException:
+                status = None
+            return (time.perf_counter() - started) * 1000, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(send, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        timings = [timing for timing, _ in results]
+        errors = sum(
+            1 for _, status in results if status is None or status >= 400)
+        self.stdout.write(
+            f'Запросов: {len(results)}, ошибок: {errors}, '
+            f'параллельно: {options["concurrency"]}\n'
+            f'{len(results) / elapsed:.0f} запросов/с, '
+            f'p50 {percentile(timings, 50):.0f} мс, '
+            f'p95 {percentile(timings, 95):.0f} мс, '
+            f'p99 {percentile(timings, 99):.0f} мс'
+        )
+        if errors:
+            raise CommandError(f'Ошибочных ответов: {errors}')
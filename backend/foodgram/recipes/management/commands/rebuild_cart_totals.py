@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from recipes.cart import rebuild_totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild shopping cart totals from shopping carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Нужна после изменения ингредиентов рецептов в обход модели
+        # (bulk-операции, SQL) и после загрузки данных
+        count = rebuild_totals(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Итогов корзин покупок: {count}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from recipes.feed import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild subscription feeds from subscriptions: last recipes '
+        'of every author with fan-out on write'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах подписок: {count}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized popularity counters'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, fixed in recount().items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: '
+                f'исправлено записей: {fixed}'
+            ))
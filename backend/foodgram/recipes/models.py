@@ -1,7 +1,10 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from colorfield.fields import ColorField
+from users.models import CountersMixin
+from .fields import PostgresArrayField
 from .validators import validate_amount
 
 User = get_user_model()
@@ -42,12 +45,18 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         related_name='recipes',
@@ -62,6 +71,12 @@ class Recipe(models.Model):
         upload_to='media/',
         verbose_name='Картинка'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки'
+    )
     text = models.TextField(
         verbose_name='Текстовое описание'
     )
@@ -84,11 +99,58 @@ class Recipe(models.Model):
         )
     )
     created = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
+    # Теги рецепта для отбора по тегам (recipes.tag_mask):
+    # в PostgreSQL - массив id тегов,
+    # в остальных СУБД - бит (id - 1) для каждого тега с id до 63
+    tag_ids = PostgresArrayField(
+        models.BigIntegerField(),
+        null=True,
+        editable=False,
+        verbose_name='Теги'
+    )
+    tags_mask = models.BigIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Маска тегов'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в корзину покупок'
+    )
+
+    COUNTER_FIELDS = ('favorites_count', 'shopping_cart_count')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-created']
+        indexes = [
+            # Список рецептов и keyset-пагинация по (-created, id)
+            models.Index(
+                fields=('-created', 'id'),
+                name='recipe_created_idx'
+            ),
+            # Рецепты автора и превью рецептов в подписках
+            models.Index(
+                fields=('author', '-created'),
+                name='recipe_author_created_idx'
+            ),
+            # ?ordering=-favorites_count
+            models.Index(
+                fields=('-favorites_count',),
+                name='recipe_favorites_count_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name} (автор {self.author})'
@@ -182,6 +244,40 @@ class ShoppingCart(models.Model):
         return f'{self.recipe} - {self.user}'
 
 
+class CartTotal(models.Model):
+    '''
+    Сколько ингредиента нужно по всем рецептам корзины покупок
+    пользователя. Обновляется при изменении корзины и рецептов в ней
+    (recipes.cart)
+    '''
+    user = models.ForeignKey(
+        User,
+        related_name='cart_totals',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='+',
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE
+    )
+    amount = models.FloatField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Итог корзины покупок'
+        verbose_name_plural = 'Итоги корзины покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_cart_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient} - {self.amount}'
+
+
 class Subscriptions(models.Model):
     author = models.ForeignKey(
         User,
@@ -205,3 +301,49 @@ class Subscriptions(models.Model):
                 name='unique_subscription'
             )
         ]
+
+
+class FeedEntry(models.Model):
+    '''
+    Рецепт в ленте подписок пользователя. Автор и время создания
+    рецепта продублированы, чтобы лента читалась по одному индексу
+    '''
+    user = models.ForeignKey(
+        User,
+        related_name='feed',
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        verbose_name='Автор',
+        on_delete=models.CASCADE
+    )
+    created = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-created', 'recipe'),
+                name='feed_entry_order_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='feed_entry_author_idx'
+            ),
+        ]
@@ -0,0 +1,78 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity
+)
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+SEARCH_CONFIG = 'russian'
+
+SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+)
+
+# Индексы только для PostgreSQL: создаются после migrate,
+# на других СУБД поиск работает без них
+POSTGRES_SEARCH_SQL = (
+    # Поиск ингредиентов по началу названия без учета регистра
+    # (api.filters.IngredientSearchFilter): LIKE 'префикс%' по индексу
+    # при любой локали БД
+    'CREATE INDEX IF NOT EXISTS ingredient_name_lower_idx '
+    'ON recipes_ingredient (lower(name) varchar_pattern_ops)',
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS recipe_name_trgm_idx '
+    'ON recipes_recipe USING gin (name gin_trgm_ops)',
+)
+
+
+def is_postgresql(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def update_search_vector(queryset):
+    if is_postgresql(queryset.db):
+        queryset.update(search_vector=SEARCH_VECTOR)
+
+
+def create_search_indexes(sender, using, **kwargs):
+    '''
+    Обработчик post_migrate: индексы поиска рецептов и ингредиентов
+    и заполнение search_vector для старых рецептов
+    '''
+    from .models import Recipe
+
+    if not is_postgresql(using):
+        return
+    with connections[using].cursor() as cursor:
+        for sql in POSTGRES_SEARCH_SQL:
+            cursor.execute(sql)
+    update_search_vector(
+        Recipe.objects.using(using).filter(search_vector=None))
+
+
+def search_recipes(queryset, value):
+    '''
+    Рецепты, подходящие под поисковую строку, по убыванию релевантности.
+    В PostgreSQL: полнотекстовый поиск с русской морфологией по
+    названию и описанию или похожее (с опечаткой) название.
+    В остальных СУБД: вхождение подстроки
+    '''
+    if not is_postgresql(queryset.db):
+        return queryset.filter(
+            Q(name__icontains=value) | Q(text__icontains=value)
+        ).order_by('-created')
+    query = SearchQuery(value, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.filter(
+        Q(search_vector=query) | Q(name__trigram_similar=value)
+    ).annotate(
+        rank=Greatest(
+            SearchRank(F('search_vector'), query),
+            TrigramSimilarity('name', value)
+        )
+    ).order_by('-rank', '-created')
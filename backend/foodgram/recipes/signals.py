@@ -0,0 +1,338 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_save
+)
+from django.dispatch import receiver
+
+from . import cart, feed
+from .images import needs_variants, schedule_variants
+from .ingredient_index import ingredient_index
+from .search import update_search_vector
+from .similar import similar_index
+from .tag_mask import update_tags, with_tag
+from .models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Subscriptions,
+    Tag
+)
+from .versions import author_scope, bump_version, recipe_scope, user_scope
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: ingredient_index.update(instance))
+
+
+@receiver(post_delete, sender=Ingredient)
+def delete_from_ingredient_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: ingredient_index.delete(pk))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_similar_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: similar_index.invalidate(pk))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_similar_index_ingredients(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: similar_index.invalidate(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    update_search_vector(Recipe.objects.filter(pk=instance.pk))
+
+
+# Теги в записи рецепта пересчитываются по связи рецептов и тегов
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_recipe_tags(sender, instance, action, reverse, pk_set,
+                       **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        update_tags(Recipe.objects.filter(pk=instance.pk))
+    elif pk_set:
+        update_tags(Recipe.objects.filter(pk__in=pk_set))
+    else:
+        # clear у тега: рецепты, в тегах которых он записан
+        update_tags(with_tag(Recipe.objects.all(), instance.pk))
+
+
+@receiver(post_delete, sender=Tag)
+def remove_tag_from_recipes(sender, instance, **kwargs):
+    update_tags(with_tag(Recipe.objects.all(), instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    if needs_variants(instance):
+        schedule_variants(instance)
+
+
+# Версии данных для ETag/Last-Modified, обновляются после коммита
+def on_commit_bump(*scopes):
+    transaction.on_commit(lambda: bump_version(*scopes))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    on_commit_bump('tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    on_commit_bump('ingredients')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    on_commit_bump('recipes', recipe_scope(instance.pk))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def bump_recipe_ingredients_version(sender, instance, **kwargs):
+    on_commit_bump('recipes', recipe_scope(instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_recipe_relations_version(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Изменены рецепты тега/ингредиента: pk_set пуст для clear
+        recipe_ids = pk_set or ()
+    else:
+        recipe_ids = (instance.pk,)
+    on_commit_bump(
+        'recipes', *(recipe_scope(recipe_id) for recipe_id in recipe_ids))
+
+
+# Поля пользователя в представлении рецепта (api.serializers.AuthorSerializer)
+AUTHOR_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+
+def changes_author_fields(update_fields):
+    return update_fields is None or bool(
+        set(update_fields) & set(AUTHOR_FIELDS))
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, update_fields=None, **kwargs):
+    # Прежние поля автора - чтобы не сбрасывать кэш рецептов
+    # при смене пароля, входе и других изменениях
+    instance.saved_author_fields = None
+    if not instance._state.adding and changes_author_fields(update_fields):
+        instance.saved_author_fields = User.objects.filter(
+            pk=instance.pk).values_list(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def bump_author_version(sender, instance, created, **kwargs):
+    # У нового пользователя еще нет рецептов
+    saved = getattr(instance, 'saved_author_fields', None)
+    if created or saved is None or saved == tuple(
+        getattr(instance, field) for field in AUTHOR_FIELDS
+    ):
+        return
+    # Списки рецептов меняются, только если он автор
+    if Recipe.objects.filter(author_id=instance.pk).exists():
+        on_commit_bump('recipes', author_scope(instance.pk))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Subscriptions)
+@receiver(post_delete, sender=Subscriptions)
+def bump_user_version(sender, instance, **kwargs):
+    on_commit_bump(user_scope(instance.user_id))
+
+
+# Лента подписок: обновляется в той же транзакции, что и запись
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        feed.fan_out(instance)
+
+
+@receiver(post_save, sender=Subscriptions)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill([instance])
+
+
+@receiver(post_delete, sender=Subscriptions)
+def clear_feed(sender, instance, **kwargs):
+    feed.forget([instance])
+
+
+# Итоги корзины покупок: обновляются в той же транзакции, что и корзина
+# и ингредиенты рецептов. При удалении рецепта его ингредиенты и записи
+# корзин удаляются по очереди: вклад пары (корзина, ингредиент) вычитает
+# тот обработчик post_delete, который срабатывает первым, второй уже
+# не находит пары
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        cart.change_cart(instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def subtract_from_cart_totals(sender, instance, **kwargs):
+    cart.change_cart(instance.user_id, [instance.recipe_id], -1)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, **kwargs):
+    # Прежние рецепт, ингредиент и количество - для разницы итогов
+    instance.saved_state = None
+    if instance.pk is not None:
+        instance.saved_state = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_cart_totals_ingredient(sender, instance, **kwargs):
+    changes = {}
+    if instance.saved_state is not None:
+        recipe_id, ingredient_id, amount = instance.saved_state
+        changes.setdefault(recipe_id, Counter())[ingredient_id] -= amount
+    changes.setdefault(instance.recipe_id, Counter())[
+        instance.ingredient_id] += instance.amount
+    for recipe_id, deltas in changes.items():
+        cart.change_recipe(recipe_id, deltas)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def subtract_cart_totals_ingredient(sender, instance, **kwargs):
+    cart.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+# Счетчики популярности: обновляются в той же транзакции, что и запись.
+# Для каждой модели: модель со счетчиком, поле-ссылка и поле счетчика
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'shopping_cart_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Subscriptions: (User, 'author_id', 'followers_count'),
+}
+
+
+def change_counter(model, pks, field, delta):
+    value = F(field) + delta
+    if delta < 0:
+        # Разошедшийся счетчик не уходит ниже нуля (CHECK поля),
+        # его исправит recount_counters
+        value = Greatest(value, 0)
+    model.objects.filter(pk__in=pks).update(**{field: value})
+
+
+def increase_counter(sender, instance, created, **kwargs):
+    if created:
+        model, link, field = COUNTERS[sender]
+        change_counter(model, (getattr(instance, link),), field, 1)
+
+
+def decrease_counter(sender, instance, **kwargs):
+    model, link, field = COUNTERS[sender]
+    change_counter(model, (getattr(instance, link),), field, -1)
+
+
+for counted_model in COUNTERS:
+    post_save.connect(increase_counter, sender=counted_model)
+    post_delete.connect(decrease_counter, sender=counted_model)
+
+
+# Подключен после decrease_counter: нужен уже уменьшенный счетчик
+@receiver(post_delete, sender=Subscriptions)
+def refill_feeds(sender, instance, **kwargs):
+    feed.refill([instance.author_id])
+
+
+def change_counters(sender, instances, sign):
+    model, link, field = COUNTERS[sender]
+    # Ссылки в пачке могут повторяться: группируем их по приросту
+    deltas = Counter(getattr(instance, link) for instance in instances)
+    for delta in set(deltas.values()):
+        change_counter(
+            model,
+            [pk for pk, count in deltas.items() if count == delta],
+            field,
+            sign * delta
+        )
+
+
+def group_by_user(instances, link):
+    grouped = {}
+    for instance in instances:
+        grouped.setdefault(instance.user_id, []).append(
+            getattr(instance, link))
+    return grouped
+
+
+def bulk_post_create(sender, instances):
+    '''
+    Замена post_save для избранного, корзины и подписок,
+    созданных через bulk_create: он не отправляет сигналы,
+    поэтому счетчики, версии, лента и итоги корзины обновляются здесь
+    для всей пачки
+    '''
+    if not instances:
+        return
+    change_counters(sender, instances, 1)
+    if sender is Subscriptions:
+        feed.backfill(instances)
+    if sender is ShoppingCart:
+        for user_id, recipe_ids in group_by_user(
+                instances, 'recipe_id').items():
+            cart.change_cart(user_id, recipe_ids, 1)
+    on_commit_bump(
+        *{user_scope(instance.user_id) for instance in instances})
+
+
+def bulk_post_delete(sender, instances):
+    '''
+    Замена post_delete для избранного, корзины и подписок, удаленных
+    одним запросом без сигналов: запросов на пачку столько же,
+    сколько на одну запись
+    '''
+    if not instances:
+        return
+    change_counters(sender, instances, -1)
+    if sender is Subscriptions:
+        feed.forget(instances)
+        feed.refill({instance.author_id for instance in instances})
+    if sender is ShoppingCart:
+        for user_id, recipe_ids in group_by_user(
+                instances, 'recipe_id').items():
+            cart.change_cart(user_id, recipe_ids, -1)
+    on_commit_bump(
+        *{user_scope(instance.user_id) for instance in instances})
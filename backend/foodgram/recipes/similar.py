@@ -0,0 +1,269 @@
+import heapq
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from scipy.sparse import csr_matrix
+
+from .models import Recipe, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+# Вес совпадения тегов относительно совпадения ингредиентов
+TAG_WEIGHT = 0.5
+
+
+def jaccard(first, second):
+    common = len(first & second)
+    if not common:
+        return 0.0
+    return common / (len(first) + len(second) - common)
+
+
+def pairs(queryset):
+    '''
+    Пары (id, id) из values_list - массивом n x 2
+    '''
+    return np.fromiter(
+        (value for pair in queryset.iterator() for value in pair),
+        dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def incidence(rows, columns, shape):
+    return csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+
+
+def row_columns(matrix, row):
+    return matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+
+
+class SimilarRecipesIndex:
+    '''
+    Индекс похожих рецептов в памяти процесса: разреженные матрицы
+    рецепт x ингредиент и рецепт x тег. Похожесть - мера Жаккара
+    по ингредиентам плюс TAG_WEIGHT * мера Жаккара по тегам.
+    Число общих ингредиентов со всеми рецептами сразу - сумма столбцов
+    матрицы для ингредиентов рецепта, оценка и выбор лучших - векторно,
+    без сравнения пар рецептов в Python.
+    Строится при первом запросе. Рецепты, измененные в этом процессе,
+    перечитываются при следующем поиске: их строки в матрице
+    отключаются, а сами рецепты до перестроения оцениваются отдельно
+    (их мало). Изменения из других процессов подхватываются
+    перестроением в фоне раз в SIMILAR_INDEX_TTL секунд
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.load(np.empty((0, 2), np.int64), np.empty((0, 2), np.int64))
+        self._dirty = set()
+        # Рецепты, перечитанные во время перестроения: после него
+        # их нужно перечитать снова
+        self._refreshed = set()
+        self._built_at = None
+        self._building = False
+
+    def load(self, ingredients, tags):
+        '''
+        Матрицы по парам (рецепт, ингредиент) и (рецепт, тег)
+        '''
+        ids, rows = np.unique(ingredients[:, 0], return_inverse=True)
+        ingredient_ids, columns = np.unique(
+            ingredients[:, 1], return_inverse=True)
+        recipes = incidence(rows, columns, (len(ids), len(ingredient_ids)))
+        # В индексе только рецепты с ингредиентами
+        tag_rows = np.searchsorted(ids, tags[:, 0])
+        indexed = tag_rows < len(ids)
+        indexed[indexed] = ids[tag_rows[indexed]] == tags[indexed, 0]
+        tag_ids, tag_columns = np.unique(tags[indexed, 1], return_inverse=True)
+        recipe_tags = incidence(
+            tag_rows[indexed], tag_columns, (len(ids), len(tag_ids)))
+        with self._lock:
+            self._ids = ids
+            self._rows = {
+                recipe_id: row for row, recipe_id in enumerate(ids.tolist())
+            }
+            self._recipes = recipes
+            self._postings = recipes.tocsc()
+            self._sizes = np.diff(recipes.indptr)
+            self._ingredient_ids = ingredient_ids
+            self._columns = {
+                ingredient_id: column
+                for column, ingredient_id in enumerate(ingredient_ids.tolist())
+            }
+            self._tags = recipe_tags
+            self._tag_sizes = np.diff(recipe_tags.indptr)
+            self._tag_ids = tag_ids
+            self._tag_columns = {
+                tag_id: column
+                for column, tag_id in enumerate(tag_ids.tolist())
+            }
+            self._valid = np.ones(len(ids), dtype=bool)
+            # Рецепты, измененные после построения матриц:
+            # id -> (ингредиенты, теги)
+            self._changed = {}
+
+    def build(self):
+        with self._lock:
+            self._building = True
+        self.load(
+            pairs(RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id')),
+            pairs(Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id'))
+        )
+        with self._lock:
+            self._dirty |= self._refreshed
+            self._refreshed = set()
+            self._built_at = time.monotonic()
+            self._building = False
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс похожих рецептов')
+            with self._lock:
+                self._building = False
+        finally:
+            connection.close()
+
+    def _refresh_stale(self):
+        with self._lock:
+            if self._building or (
+                time.monotonic() - self._built_at
+                <= settings.SIMILAR_INDEX_TTL
+            ):
+                return
+            self._building = True
+        threading.Thread(
+            target=self._rebuild, name='similar-recipes', daemon=True
+        ).start()
+
+    def _refresh_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            if self._building:
+                self._refreshed |= dirty
+        if not dirty:
+            return
+        ingredients = {}
+        tags = {}
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=dirty).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+        rows = Recipe.tags.through.objects.filter(
+            recipe_id__in=dirty).values_list('recipe_id', 'tag_id')
+        for recipe_id, tag_id in rows:
+            tags.setdefault(recipe_id, set()).add(tag_id)
+        with self._lock:
+            for recipe_id in dirty:
+                row = self._rows.get(recipe_id)
+                if row is not None:
+                    self._valid[row] = False
+                # Удаленный рецепт остается без ингредиентов
+                if recipe_id in ingredients:
+                    self._changed[recipe_id] = (
+                        frozenset(ingredients[recipe_id]),
+                        frozenset(tags.get(recipe_id, ()))
+                    )
+                else:
+                    self._changed.pop(recipe_id, None)
+
+    def invalidate(self, recipe_id):
+        with self._lock:
+            if self._built_at is not None:
+                self._dirty.add(recipe_id)
+
+    def _recipe(self, recipe_id):
+        '''
+        Ингредиенты и теги рецепта; None, если его нет в индексе
+        '''
+        if recipe_id in self._changed:
+            return self._changed[recipe_id]
+        row = self._rows.get(recipe_id)
+        if row is None or not self._valid[row]:
+            return None
+        return (
+            frozenset(self._ingredient_ids[
+                row_columns(self._recipes, row)].tolist()),
+            frozenset(self._tag_ids[row_columns(self._tags, row)].tolist())
+        )
+
+    def _score_matrix(self, recipe_id, ingredients, tags, limit):
+        '''
+        Не больше limit лучших (оценка, id) среди строк матрицы,
+        плюс рецепты с той же оценкой, что у последнего из них
+        '''
+        columns = [
+            self._columns[ingredient_id] for ingredient_id in ingredients
+            if ingredient_id in self._columns
+        ]
+        if not columns:
+            return []
+        postings = self._postings
+        common = np.bincount(
+            np.concatenate([row_columns(postings, column)
+                            for column in columns]),
+            minlength=len(self._ids)
+        )
+        common[~self._valid] = 0
+        row = self._rows.get(recipe_id)
+        if row is not None:
+            common[row] = 0
+        candidates = np.flatnonzero(common)
+        shared = common[candidates]
+        scores = shared / (len(ingredients) + self._sizes[candidates] - shared)
+        tag_columns = [
+            self._tag_columns[tag_id] for tag_id in tags
+            if tag_id in self._tag_columns
+        ]
+        if tag_columns:
+            query_tags = np.zeros(len(self._tag_ids), dtype=np.float32)
+            query_tags[tag_columns] = 1
+            shared_tags = (self._tags @ query_tags)[candidates]
+            scores += TAG_WEIGHT * (shared_tags / (
+                len(tags) + self._tag_sizes[candidates] - shared_tags))
+        if len(candidates) > limit:
+            # Равные порогу берутся все: порядок при равенстве
+            # оценок - по id, как в heapq.nlargest
+            threshold = np.partition(scores, -limit)[-limit]
+            best = scores >= threshold
+            candidates, scores = candidates[best], scores[best]
+        return list(zip(scores.tolist(), self._ids[candidates].tolist()))
+
+    def search(self, recipe_id, limit):
+        '''
+        id рецептов, похожих на recipe_id, от самого похожего;
+        None, если рецепта нет в индексе
+        '''
+        if self._built_at is None:
+            self.build()
+        else:
+            self._refresh_stale()
+        if self._dirty:
+            self._refresh_dirty()
+        with self._lock:
+            recipe = self._recipe(recipe_id)
+            if recipe is None:
+                return None
+            ingredients, tags = recipe
+            scored = self._score_matrix(recipe_id, ingredients, tags, limit)
+            scored.extend(
+                (
+                    jaccard(ingredients, other_ingredients)
+                    + TAG_WEIGHT * jaccard(tags, other_tags),
+                    other
+                )
+                for other, (other_ingredients, other_tags)
+                in self._changed.items()
+                if other != recipe_id and ingredients & other_ingredients
+            )
+        return [other for _, other in heapq.nlargest(limit, scored)]
+
+
+similar_index = SimilarRecipesIndex()
@@ -0,0 +1,165 @@
+from functools import reduce
+from operator import and_, or_
+
+from django.contrib.postgres.fields import ArrayField
+from django.db import connections
+from django.db.models import (
+    BigIntegerField,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value
+)
+from django.db.models.functions import Cast, Coalesce
+
+from .search import is_postgresql
+
+# Теги рецепта хранятся в самой записи рецепта: отбор по тегам - одно
+# условие на поле без JOIN и DISTINCT.
+# В PostgreSQL - массив id тегов Recipe.tag_ids с GIN-индексом:
+# отбор по операторам && и @> читает только подходящие рецепты.
+# В остальных СУБД - маска Recipe.tags_mask: тегу с id n соответствует
+# бит n - 1. Тегов обычно несколько; для тегов с id больше MAX_TAG_ID
+# бита нет, по ним рецепты отбираются подзапросом к связи рецептов
+# и тегов
+MAX_TAG_ID = 63
+
+POSTGRES_TAGS_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipe_tag_ids_idx '
+    'ON recipes_recipe USING gin (tag_ids)',
+)
+
+
+class ArraySubquery(Subquery):
+    template = 'ARRAY(%(subquery)s)'
+
+    def __init__(self, queryset, base_field, **kwargs):
+        super().__init__(
+            queryset, output_field=ArrayField(base_field), **kwargs)
+
+
+def tag_bit(tag_id):
+    return 1 << (tag_id - 1) if tag_id <= MAX_TAG_ID else None
+
+
+def tags_mask():
+    '''
+    Выражение: маска тегов рецепта по связи рецептов и тегов
+    '''
+    from .models import Recipe
+
+    through = Recipe.tags.through
+    # В PostgreSQL сдвиг bigint - только на integer
+    bit = Cast(Value(1), BigIntegerField()).bitleftshift(
+        Cast(F('tag_id') - 1, IntegerField()))
+    return Coalesce(
+        Subquery(
+            through.objects.filter(
+                recipe=OuterRef('pk'), tag_id__lte=MAX_TAG_ID
+            ).order_by().values('recipe').annotate(
+                mask=Sum(bit, output_field=BigIntegerField())
+            ).values('mask'),
+            output_field=BigIntegerField()
+        ),
+        0
+    )
+
+
+def tag_ids():
+    '''
+    Выражение: id тегов рецепта по связи рецептов и тегов
+    '''
+    from .models import Recipe
+
+    through = Recipe.tags.through
+    return ArraySubquery(
+        through.objects.filter(recipe=OuterRef('pk')).order_by(
+            'tag_id').values('tag_id'),
+        BigIntegerField()
+    )
+
+
+def update_tags(queryset):
+    if is_postgresql(queryset.db):
+        queryset.update(tag_ids=tag_ids())
+    else:
+        queryset.update(tags_mask=tags_mask())
+
+
+def without_tags(queryset):
+    '''
+    Рецепты, для которых теги в записи еще не посчитаны
+    '''
+    if is_postgresql(queryset.db):
+        return queryset.filter(tag_ids=None)
+    return queryset.filter(tags_mask=None)
+
+
+def with_tag(queryset, tag_id):
+    '''
+    Рецепты, в тегах которых записан тег tag_id
+    '''
+    if is_postgresql(queryset.db):
+        return queryset.filter(tag_ids__contains=[tag_id])
+    if tag_bit(tag_id) is None:
+        return queryset.none()
+    return queryset.alias(
+        tag_match=F('tags_mask').bitand(tag_bit(tag_id))
+    ).filter(tag_match__gt=0)
+
+
+def filter_by_tags(queryset, tags, match_all=False):
+    '''
+    Рецепты хотя бы с одним из тегов tags или, если match_all,
+    со всеми тегами сразу
+    '''
+    if is_postgresql(queryset.db):
+        ids = [tag.pk for tag in tags]
+        if match_all:
+            return queryset.filter(tag_ids__contains=ids)
+        return queryset.filter(tag_ids__overlap=ids)
+    through = queryset.model.tags.through
+    mask = 0
+    unmasked = []
+    for tag in tags:
+        bit = tag_bit(tag.pk)
+        if bit is None:
+            unmasked.append(tag)
+        else:
+            mask |= bit
+    # Псевдоним свой для каждого режима: фильтры можно сочетать
+    alias = 'all_tags_match' if match_all else 'tags_match'
+    conditions = []
+    if mask:
+        queryset = queryset.alias(**{alias: F('tags_mask').bitand(mask)})
+        if match_all:
+            conditions.append(Q(**{alias: mask}))
+        else:
+            conditions.append(Q(**{f'{alias}__gt': 0}))
+    if match_all:
+        conditions.extend(
+            Q(pk__in=through.objects.filter(tag=tag).values('recipe'))
+            for tag in unmasked
+        )
+    elif unmasked:
+        conditions.append(Q(
+            pk__in=through.objects.filter(tag__in=unmasked).values('recipe')
+        ))
+    return queryset.filter(reduce(and_ if match_all else or_, conditions))
+
+
+def fill_tags(sender, using, **kwargs):
+    '''
+    Обработчик post_migrate: индекс тегов в PostgreSQL
+    и теги в записи для старых рецептов
+    '''
+    from .models import Recipe
+
+    if is_postgresql(using):
+        with connections[using].cursor() as cursor:
+            for sql in POSTGRES_TAGS_SQL:
+                cursor.execute(sql)
+    update_tags(without_tags(Recipe.objects.using(using)))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def author_scope(user_id):
+    return f'author:{user_id}'
+
+
+def recipe_scope(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def bump_version(*scopes):
+    '''
+    Отмечает изменение данных: версия - время изменения в наносекундах,
+    поэтому она не повторяется даже после вытеснения ключа из кэша
+    '''
+    now = time.time_ns()
+    cache.set_many(
+        {VERSION_KEY.format(scope): now for scope in scopes}, timeout=None)
+
+
+def get_versions(*scopes):
+    '''
+    Версии указанных областей данных. Отсутствующая в кэше версия
+    считается только что измененной
+    '''
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
@@ -1,12 +1,59 @@
 from django.contrib.auth.models import AbstractUser
-from django.db.models import CharField, EmailField
+from django.db.models import (
+    CharField,
+    EmailField,
+    Index,
+    PositiveIntegerField
+)
 from django.utils.translation import gettext_lazy as _
 
 
-class User(AbstractUser):
+class CountersMixin:
+    '''
+    Поля-счетчики COUNTER_FIELDS меняются только запросами UPDATE
+    с F() (recipes.signals). save() существующей записи их не пишет:
+    значение из памяти затерло бы приращения, сделанные после того,
+    как объект был прочитан
+    '''
+    COUNTER_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                # Как и save() без update_fields, не пишем
+                # неподгруженные поля
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs['update_fields'] = [
+                name for name in update_fields
+                if name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     email = EmailField(_('email address'), unique=True)
     first_name = CharField(_('first name'), max_length=150)
     last_name = CharField(_('last name'), max_length=150)
+    recipes_count = PositiveIntegerField(
+        'Количество рецептов', default=0, editable=False)
+    followers_count = PositiveIntegerField(
+        'Количество подписчиков', default=0, editable=False)
 
+    COUNTER_FIELDS = ('recipes_count', 'followers_count')
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username']
     USERNAME_FIELD = 'email'
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Авторы с подписчиками сверх FEED_FANOUT_LIMIT, рецепты
+            # которых лента добирает при чтении (recipes.feed)
+            Index(
+                fields=('followers_count',),
+                name='user_followers_count_idx'
+            ),
+        ]
@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+
+from recipes.counters import recount
+
+User = get_user_model()
+
+PASSWORD = 'Old-password-2023'
+NEW_PASSWORD = 'New-password-2024'
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com',
+        username=name,
+        first_name='Имя',
+        last_name='Фамилия',
+        password=PASSWORD
+    )
+
+
+class CountersTest(APITestCase):
+    '''
+    Счетчики не затираются сохранением пользователя,
+    прочитанного до их изменения
+    '''
+    def setUp(self):
+        self.author = create_user('author')
+        self.followers = [create_user(f'follower{i}') for i in range(3)]
+
+    def test_set_password_keeps_followers_count(self):
+        stale_author = User.objects.get(pk=self.author.pk)
+        for follower in self.followers:
+            self.client.force_authenticate(follower)
+            response = self.client.post(
+                f'/api/users/{self.author.pk}/subscribe/')
+            self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(stale_author)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': PASSWORD,
+            'new_password': NEW_PASSWORD,
+        })
+        self.assertEqual(response.status_code, 204)
+
+        author = User.objects.get(pk=self.author.pk)
+        self.assertTrue(author.check_password(NEW_PASSWORD))
+        self.assertEqual(author.followers_count, len(self.followers))
+        self.assertEqual(recount()[User], 0)